@@ -1,3 +1,5 @@
+from decouple import config
+
 from .settings import *
 
 SECRET_KEY = config("SECRET_KEY")
@@ -19,6 +21,16 @@ CSRF_TRUSTED_ORIGINS = ["https://" + host for host in ALLOWED_HOSTS]
 #     },
 # }
 
+# The catalog cache is invalidated by writes from any worker, so it needs a
+# cache shared by all of them
+if config("REDIS_URL", ""):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": config("REDIS_URL"),
+        }
+    }
+
 INSTALLED_APPS.remove("debug_toolbar")
 MIDDLEWARE.remove("debug_toolbar.middleware.DebugToolbarMiddleware")
 
@@ -234,6 +234,20 @@ LOGGING = {
 
 SHIPPING_FEES = config("SHIPPING_FEES", 0)
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "e-shop",
+    }
+}
+
+# Product list and detail responses, see shop/cache.py
+CATALOG_CACHE_ALIAS = "default"
+CATALOG_CACHE_TIMEOUT = config("CATALOG_CACHE_TIMEOUT", 60 * 5, cast=int)
+
 # JAZZMIN CONFIG
 JAZZMIN_SETTINGS = {
     "site_brand": "V-W ADMIN",
@@ -14,3 +14,14 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Storefront.settings')
 
 application = get_wsgi_application()
+
+# Build the in-memory autocomplete index before the first request
+from django.db import DatabaseError  # noqa: E402
+
+from shop.autocomplete import title_index  # noqa: E402
+
+try:
+    title_index.build()
+except DatabaseError:
+    # Not migrated yet, the index is built on first use
+    pass
@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2023-04-29 10:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("likes", "0003_rename_likeditem_like"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="like",
+            name="created_at",
+            field=models.DateTimeField(
+                auto_now_add=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2023-05-04 11:20
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicate_likes(apps, schema_editor):
+    Like = apps.get_model("likes", "Like")
+
+    duplicates = (
+        Like.objects.values("user", "content_type", "object_id")
+        .annotate(first=Min("id"), total=Count("id"))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates:
+        Like.objects.filter(
+            user=duplicate["user"],
+            content_type=duplicate["content_type"],
+            object_id=duplicate["object_id"],
+        ).exclude(pk=duplicate["first"]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("likes", "0004_like_created_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_likes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="like",
+            constraint=models.UniqueConstraint(
+                fields=("user", "content_type", "object_id"), name="like_unique"
+            ),
+        ),
+    ]
@@ -1,7 +1,8 @@
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.utils import timezone
 
 # Create your models here.
 
@@ -13,16 +14,125 @@ class LikesManager(models.Manager):
         return query
 
     
-    def objects_liked_by_user(self, user, content_object):
+    def objects_liked_by_user(self, user, content_object, queryset=None):
         content_type = ContentType.objects.get_for_model(content_object)
         likes = self.filter(
             content_type = content_type, 
             user = user
         )
 
-        _ids = [item.object_id for item in likes]
-        
-        return content_object.objects.filter(pk__in = _ids)
+        if queryset is None:
+            queryset = content_object.objects.all()
+
+        return queryset.filter(pk__in = likes.values("object_id"))
+
+    def liked_ids(self, user, model, object_ids):
+        """The ids among `object_ids` of the `model` objects `user` likes."""
+        if not user.is_authenticated or not object_ids:
+            return set()
+        content_type = ContentType.objects.get_for_model(model)
+        return set(
+            self.filter(
+                content_type=content_type, user=user, object_id__in=object_ids
+            ).values_list("object_id", flat=True)
+        )
+
+    def toggle(self, user, model, object_id):
+        """
+        Like the `model` object `object_id` for `user`, or remove the like, in
+        at most two statements: a DELETE ... RETURNING, then when nothing was
+        deleted an INSERT ... ON CONFLICT DO NOTHING of the object if it
+        exists. The unique constraint makes concurrent toggles safe. Databases
+        without RETURNING or ON CONFLICT get the same result from
+        `toggle_with_orm()`.
+
+        Returns (liked, created_at of the inserted or deleted like), the date
+        is None when a concurrent request inserted the like first. Raises
+        `model.DoesNotExist` for a missing object. The Like signals are not
+        sent, callers update whatever depends on the likes.
+        """
+        content_type = ContentType.objects.get_for_model(model)
+        features = connection.features
+        if not (
+            features.can_return_rows_from_bulk_insert
+            and features.supports_update_conflicts_with_target
+        ):
+            return self.toggle_with_orm(user, content_type, model, object_id)
+
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        table = qn(opts.db_table)
+        user_field = opts.get_field("user")
+        created_field = opts.get_field("created_at")
+        user_id, content_type_id, object_id_column, created_at_column = [
+            qn(opts.get_field(name).column)
+            for name in ["user", "content_type", "object_id", "created_at"]
+        ]
+        params = [
+            user_field.get_db_prep_value(user.pk, connection),
+            content_type.pk,
+            object_id,
+        ]
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {table} WHERE {user_id} = %s "
+                f"AND {content_type_id} = %s AND {object_id_column} = %s "
+                f"RETURNING {created_at_column}",
+                params,
+            )
+            row = cursor.fetchone()
+            if row is not None:
+                column = created_field.get_col(opts.db_table)
+                created_at = row[0]
+                converters = connection.ops.get_db_converters(
+                    column
+                ) + column.get_db_converters(connection)
+                for converter in converters:
+                    created_at = converter(created_at, column, connection)
+                return False, created_at
+
+            created_at = timezone.now()
+            cursor.execute(
+                f"INSERT INTO {table} ({user_id}, {content_type_id}, "
+                f"{object_id_column}, {created_at_column}) "
+                f"SELECT %s, %s, %s, %s WHERE EXISTS (SELECT 1 FROM "
+                f"{qn(model._meta.db_table)} WHERE {qn(model._meta.pk.column)} = %s) "
+                "ON CONFLICT DO NOTHING",
+                params
+                + [created_field.get_db_prep_value(created_at, connection), object_id],
+            )
+            if cursor.rowcount == 1:
+                return True, created_at
+
+        if not model.objects.filter(pk=object_id).exists():
+            raise model.DoesNotExist
+        return True, None
+
+    def toggle_with_orm(self, user, content_type, model, object_id):
+        """`toggle()` with a locking read, then a delete or an insert."""
+        likes = self.filter(user=user, content_type=content_type, object_id=object_id)
+        with transaction.atomic(using=self.db):
+            created_at = (
+                likes.select_for_update().values_list("created_at", flat=True).first()
+            )
+            if created_at is not None:
+                # Skips the Like signals, as the DELETE of toggle() does
+                likes._raw_delete(self.db)
+                return False, created_at
+
+            if not model.objects.filter(pk=object_id).exists():
+                raise model.DoesNotExist
+            like = self.model(
+                user=user, content_type=content_type, object_id=object_id
+            )
+            try:
+                with transaction.atomic(using=self.db):
+                    self.bulk_create([like])
+            except IntegrityError:
+                # Inserted first by a concurrent request
+                return True, None
+            return True, like.created_at
 
 
 class Like(models.Model):
@@ -31,3 +141,11 @@ class Like(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "content_type", "object_id"], name="like_unique"
+            )
+        ]
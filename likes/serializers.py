@@ -1,8 +1,8 @@
-from django.contrib.auth import get_user_model
-from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from rest_framework import serializers
 
 from .models import Like
+from .signals import like_toggled
 
 
 class LikeSerializer(serializers.ModelSerializer):
@@ -13,29 +13,27 @@ class LikeSerializer(serializers.ModelSerializer):
         fields = ['id', 'object_id']
 
     def save(self, **kwargs):
+        """Toggle the like of the user, return whether the object is now liked."""
         if self.model is None or self.model == '':
             raise serializers.ValidationError(
                     {"message": "No model_name was specified"})
 
-        content_type = ContentType.objects.get_for_model(self.model)
-        user = get_user_model().objects.get(id=self.context['user'].id)
-
-        try:
-            obj = self.model.objects.get(id=self.validated_data['object_id'])
-        except Exception:
-            raise serializers.ValidationError(
-                    {'message': f'{self.model.__name__} does not exist'})
-
-        like = Like.objects.filter(user_id=user.id, object_id=self.validated_data['object_id'],
-                                   content_type=content_type)
-        if like:
-            like.delete()
-            return None
-        self.instance = Like.objects.create(
-                user=user,
-                content_type=content_type,
-                content_object=obj,
-                **self.validated_data
-        )
-
-        return self.instance
+        object_id = self.validated_data['object_id']
+        with transaction.atomic():
+            try:
+                liked, created_at = Like.objects.toggle(
+                    self.context['user'], self.model, object_id
+                )
+            except self.model.DoesNotExist:
+                raise serializers.ValidationError(
+                        {'message': f'{self.model.__name__} does not exist'})
+
+            if created_at is not None:
+                # The toggle skips the Like signals
+                like_toggled.send(
+                    sender=self.model,
+                    object_id=object_id,
+                    liked=liked,
+                    created_at=created_at,
+                )
+        return liked
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent by LikeSerializer.save() with the `object_id`, `liked` and `created_at`
+# of the toggled like, the sender being the liked model
+like_toggled = Signal()
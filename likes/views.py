@@ -1,4 +1,3 @@
-from django.shortcuts import render
 from rest_framework import permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -18,7 +17,5 @@ class LikeView (APIView):
         serializer = self.serializer_class(
             data=request.data, context={'user': request.user})
         serializer.is_valid(raise_exception=True)
-        instance = serializer.save()
-        if instance is None:
-            self.unlike = True
+        self.unlike = not serializer.save()
         return Response(status=status.HTTP_200_OK)
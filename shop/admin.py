@@ -1,9 +1,11 @@
 from django.contrib import admin, messages
-from django.db.models.aggregates import Count
+from django.db import transaction
 from django.db.models.query import QuerySet
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.html import format_html, urlencode
 
+from shop import cache as catalog_cache
 from shop import models, forms
 
 admin.site.register([models.Color, models.Size, models.Review, models.Cart])
@@ -68,7 +70,12 @@ class ProductAdmin(admin.ModelAdmin):
 
     @admin.action(description="Clear inventory")
     def clear_inventory(self, request, queryset):
-        updated_count = queryset.update(inventory=0)
+        product_ids = list(queryset.values_list("pk", flat=True))
+        with transaction.atomic():
+            # Bulk updates skip the signal handlers touching the products
+            updated_count = queryset.update(inventory=0, last_update=timezone.now())
+            models.Product.objects.filter(pk__in=product_ids).rebuild_stock()
+        catalog_cache.invalidate_products(product_ids)
         self.message_user(
                 request,
                 f"{updated_count} products were successfully updated.",
@@ -106,9 +113,6 @@ class CollectionAdmin(admin.ModelAdmin):
                 '<a href="{}">{} Products</a>', url, collection.products_count
         )
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(products_count=Count("products"))
-
 
 # class OrderItemInline(admin.TabularInline):
 #     autocomplete_fields = ["product"]
@@ -0,0 +1,275 @@
+"""
+Typeahead suggestions of product and collection titles.
+
+Each worker keeps an in-memory prefix index: the words of every title,
+accent and case folded, in a sorted list of (word, id) pairs. A prefix query
+is a bisect to the first word starting with it followed by a scan of the
+contiguous matches, ranked by product popularity (collections by their
+product count), without touching the database. Broad prefixes walk the ids
+in rank order instead and stop at the first matches. Results of a query are
+memoized until the next change of the index, so the short and broad
+prefixes typed first are only ranked once.
+
+The index is built on first use (or at worker start, see
+Storefront/wsgi.py) and updated in place by the Product and Collection
+signal handlers once the transaction commits, only when a title is created,
+changed or deleted. Each change is also published to the other workers: the
+version in the cache is incremented and the change stored under the new
+version, and the workers, checking the version at most every
+`VERSION_CHECK_INTERVAL` seconds, replay the changes they missed. A worker
+too far behind, or missing an expired change, rebuilds its index instead, as
+do all of them after the bulk writes calling `invalidate()`. The stored
+popularity changes without a product save, so the whole index is rebuilt
+every `MAX_AGE` seconds to keep the ranking fresh.
+"""
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.db import transaction
+
+from shop import cache as catalog_cache
+from shop.models import Collection, Product
+from shop.search import tokenize
+
+VERSION_KEY = "autocomplete:version"
+CHANGE_KEY = "autocomplete:change"
+VERSION_CHECK_INTERVAL = 5
+MAX_AGE = 10 * 60
+# Beyond that many missed changes a worker rebuilds its index
+MAX_REPLAYED_CHANGES = 100
+MAX_MEMOIZED_RESULTS = 10000
+# Sorts after every character a word can continue a prefix with
+LAST_CHAR = "\U0010ffff"
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text or "")
+    return "".join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+def words_of(title):
+    return tuple(dict.fromkeys(tokenize(normalize(title))))
+
+
+def delete_sorted(values, value):
+    index = bisect_left(values, value)
+    if index < len(values) and values[index] == value:
+        del values[index]
+
+
+class PrefixIndex:
+    """
+    Sorted (word, id) pairs of titles, plus the ids sorted by rank score for
+    the broad prefixes matching a large share of the titles.
+    """
+
+    def __init__(self):
+        self.words = []
+        self.ranked = []
+        self.items = {}
+
+    def add(self, pk, title, score):
+        self.remove(pk)
+        words = words_of(title)
+        self.items[pk] = (title, score, words)
+        for word in words:
+            insort(self.words, (word, pk))
+        insort(self.ranked, (-score, title, pk))
+
+    def remove(self, pk):
+        item = self.items.pop(pk, None)
+        if item is None:
+            return
+        title, score, words = item
+        for word in words:
+            delete_sorted(self.words, (word, pk))
+        delete_sorted(self.ranked, (-score, title, pk))
+
+    def rebuild(self, rows):
+        """Replace the content with (id, title, score) rows."""
+        self.items = {}
+        pairs, ranked = [], []
+        for pk, title, score in rows:
+            words = words_of(title)
+            self.items[pk] = (title, score, words)
+            pairs.extend((word, pk) for word in words)
+            ranked.append((-score, title, pk))
+        self.words = sorted(pairs)
+        self.ranked = sorted(ranked)
+
+    def prefix_range(self, prefix):
+        """Bounds of the `words` starting with `prefix`."""
+        return (
+            bisect_left(self.words, (prefix,)),
+            bisect_left(self.words, (prefix + LAST_CHAR,)),
+        )
+
+    def matches(self, pk, tokens):
+        return all(
+            any(word.startswith(token) for word in self.items[pk][2])
+            for token in tokens
+        )
+
+    def search(self, tokens, limit):
+        """The `limit` best ids whose title has a word starting with every token."""
+        # The range of the most selective token
+        start, end = min(
+            map(self.prefix_range, tokens), key=lambda bounds: bounds[1] - bounds[0]
+        )
+
+        # Walking the ranking until `limit` matches takes about
+        # limit * len(items) / matches steps, the prefix range `matches` steps
+        if (end - start) ** 2 > limit * len(self.items):
+            found = []
+            for _, title, pk in self.ranked:
+                if self.matches(pk, tokens):
+                    found.append((pk, title))
+                    if len(found) == limit:
+                        break
+            return found
+
+        candidates = {pk for _, pk in self.words[start:end]}
+        found = [pk for pk in candidates if self.matches(pk, tokens)]
+        found.sort(key=lambda pk: (-self.items[pk][1], self.items[pk][0], pk))
+        return [(pk, self.items[pk][0]) for pk in found[:limit]]
+
+
+class Autocomplete:
+    def __init__(self):
+        self.products = PrefixIndex()
+        self.collections = PrefixIndex()
+        self.lock = threading.RLock()
+        self.results = {}
+        self.built_at = None
+        self.version = None
+        self.version_checked_at = 0
+
+    def build(self):
+        with self.lock:
+            # Read first, changes committed during the build are replayed
+            (version,) = catalog_cache.get_versions([VERSION_KEY])
+            self.products.rebuild(
+                Product.objects.values_list("pk", "title", "popularity").iterator()
+            )
+            self.collections.rebuild(
+                Collection.objects.values_list("pk", "title", "products_count")
+            )
+            self.results = {}
+            self.built_at = time.monotonic()
+            self.version = version
+            self.version_checked_at = self.built_at
+
+    def missed_changes(self, version):
+        """The changes published after this worker's version up to `version`."""
+        if not isinstance(version, int) or not isinstance(self.version, int):
+            return None
+        if not 0 < version - self.version <= MAX_REPLAYED_CHANGES:
+            return None
+        numbers = range(self.version + 1, version + 1)
+        keys = [f"{CHANGE_KEY}:{number}" for number in numbers]
+        changes = catalog_cache.get_cache().get_many(keys)
+        if len(changes) < len(keys):
+            return None
+        return [changes[key] for key in keys]
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+        if self.built_at is None or now - self.built_at > MAX_AGE:
+            self.build()
+        elif now - self.version_checked_at > VERSION_CHECK_INTERVAL:
+            self.version_checked_at = now
+            version = catalog_cache.get_cache().get(VERSION_KEY)
+            if version == self.version:
+                return
+            changes = self.missed_changes(version)
+            if changes is None:
+                self.build()
+                return
+            with self.lock:
+                for change in changes:
+                    self.apply(*change)
+                self.version = version
+                self.results = {}
+
+    def suggest(self, query, limit=8):
+        """Products and collections whose titles match the typed `query`."""
+        tokens = tuple(tokenize(normalize(query)))
+        if not tokens:
+            return {"products": [], "collections": []}
+
+        self.ensure_fresh()
+        key = (tokens, limit)
+        results = self.results.get(key)
+        if results is None:
+            with self.lock:
+                results = {
+                    name: [
+                        {"id": pk, "title": title}
+                        for pk, title in index.search(tokens, limit)
+                    ]
+                    for name, index in [
+                        ("products", self.products),
+                        ("collections", self.collections),
+                    ]
+                }
+                if len(self.results) >= MAX_MEMOIZED_RESULTS:
+                    self.results = {}
+                self.results[key] = results
+        return results
+
+    def invalidate(self):
+        """Rebuild every index on next use, after bulk writes."""
+        # Far from any version reached by publishing changes
+        cache = catalog_cache.get_cache()
+        cache.set(VERSION_KEY, catalog_cache.new_version(), timeout=None)
+        self.built_at = None
+
+    def publish(self, change):
+        """Store a change for the other workers, return its version."""
+        cache = catalog_cache.get_cache()
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            # Lost with the cache, every worker rebuilds
+            cache.set(VERSION_KEY, catalog_cache.new_version(), timeout=None)
+            return None
+        cache.set(f"{CHANGE_KEY}:{version}", change, timeout=MAX_AGE)
+        return version
+
+    def apply(self, name, pk, title, score):
+        index = getattr(self, name)
+        if title is None:
+            index.remove(pk)
+        else:
+            index.add(pk, title, score)
+
+    def changed(self, name, pk, title=None, score=0):
+        """
+        Apply a change to the `name` index of this worker and publish it to the
+        other workers, once the transaction commits.
+        """
+        transaction.on_commit(lambda: self.apply_change((name, pk, title, score)))
+
+    def apply_change(self, change):
+        # Workers rebuilding before the commit would read the previous titles
+        version = self.publish(change)
+        if self.built_at is None:
+            return
+        with self.lock:
+            self.apply(*change)
+            # Later versions are replayed, including this one
+            if version is not None and self.version == version - 1:
+                self.version = version
+            self.results = {}
+
+    def product_changed(self, product, deleted=False):
+        title = None if deleted else product.title
+        self.changed("products", product.pk, title, product.popularity)
+
+    def collection_changed(self, collection, deleted=False):
+        title = None if deleted else collection.title
+        self.changed("collections", collection.pk, title, collection.products_count)
+
+title_index = Autocomplete()
@@ -0,0 +1,145 @@
+"""
+Response cache of the product catalog endpoints.
+
+Cache keys embed version numbers instead of being deleted one by one: every
+product has its own version, bumped whenever the product or one of its images,
+inventories or reviews changes, and list responses share a single catalog
+version bumped by any change. A write therefore invalidates exactly the detail
+responses of the products it touches plus the list responses, in one or two
+cache round trips, and superseded entries simply expire.
+
+Versions are bumped once right away and once more when the transaction
+commits: a response read and cached in between, under the first new version,
+still holds the data from before the commit.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+KEY_PREFIX = "catalog"
+CATALOG_VERSION_KEY = f"{KEY_PREFIX}:version"
+STATS_KEYS = {
+    "hits": f"{KEY_PREFIX}:stats:hits",
+    "misses": f"{KEY_PREFIX}:stats:misses",
+}
+
+
+def get_cache():
+    return caches[getattr(settings, "CATALOG_CACHE_ALIAS", "default")]
+
+
+def get_timeout():
+    return getattr(settings, "CATALOG_CACHE_TIMEOUT", 60 * 5)
+
+
+def product_version_key(product_id):
+    return f"{KEY_PREFIX}:product:{product_id}:version"
+
+
+def new_version():
+    # Time based so a version evicted from the cache is never reused
+    return int(time.time() * 1000)
+
+
+def get_versions(keys):
+    cache = get_cache()
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def increment(keys):
+    cache = get_cache()
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_version(), timeout=None)
+
+
+def bump(keys):
+    """Increment the versions now and again once the transaction commits."""
+    keys = list(keys)
+    increment(keys)
+    transaction.on_commit(lambda: increment(keys))
+
+
+def invalidate_products(product_ids):
+    """Invalidate the given products and every list response."""
+    bump([product_version_key(pk) for pk in set(product_ids)] + [CATALOG_VERSION_KEY])
+
+
+def invalidate_catalog():
+    """Invalidate every list response, product details are left alone."""
+    bump([CATALOG_VERSION_KEY])
+
+
+def request_fingerprint(request):
+    """Hash of the host and the normalized (sorted) query parameters."""
+    params = sorted(
+        (key, sorted(values)) for key, values in request.query_params.lists()
+    )
+    raw = f"{request.scheme}://{request.get_host()}{request.path}?{params}"
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def response_key(request, product_id=None):
+    if product_id is None:
+        (version,) = get_versions([CATALOG_VERSION_KEY])
+        return f"{KEY_PREFIX}:list:{version}:{request_fingerprint(request)}"
+
+    (version,) = get_versions([product_version_key(product_id)])
+    return f"{KEY_PREFIX}:product:{product_id}:{version}:{request_fingerprint(request)}"
+
+
+def record(outcome):
+    cache = get_cache()
+    key = STATS_KEYS[outcome]
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def cache_stats():
+    stats = get_cache().get_many(STATS_KEYS.values())
+    hits = stats.get(STATS_KEYS["hits"], 0)
+    misses = stats.get(STATS_KEYS["misses"], 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else 0.0,
+    }
+
+
+def cached_response(request, view_method, *args, product_id=None, **kwargs):
+    """
+    Return the cached data of a GET catalog response, or call `view_method`
+    and cache its data when it succeeds. The `X-Cache` header tells which.
+    """
+    cache = get_cache()
+    key = response_key(request, product_id)
+
+    data = cache.get(key)
+    if data is not None:
+        record("hits")
+        response = Response(data, status=status.HTTP_200_OK)
+        response["X-Cache"] = "HIT"
+        return response
+
+    record("misses")
+    response = view_method(request, *args, **kwargs)
+    if response.status_code == status.HTTP_200_OK:
+        cache.set(key, response.data, timeout=get_timeout())
+    response["X-Cache"] = "MISS"
+    return response
@@ -0,0 +1,195 @@
+"""
+Validation and insertion of the items added to carts.
+
+An item names a product and optionally one of its sizes and colors, each
+variant must exist for the product and be in stock. The sizes and colors are
+resolved by name from `shop.reference_data`, then the products and the
+quantities of the requested variants of every item are read together in a
+single UNION query, rather than with up to seven queries per item, and every
+problem of every item is reported at once.
+
+Adding an item already in the cart adds to its quantity. `add_items()` does
+it for any number of items in a single INSERT ... ON CONFLICT DO UPDATE
+against the unique constraint of cart items, so concurrent adds of the same
+item neither lose increments nor create duplicate rows.
+"""
+from django.db import connection, transaction
+from django.db.models import F, IntegerField, Value
+from django.utils import timezone
+
+from shop import reference_data
+from shop.models import Cart, CartItem, ColorInventory, Product, SizeInventory
+
+VARIANTS = [
+    # field, reference cache, inventory model, inventory foreign key
+    ("size", reference_data.sizes, SizeInventory, "size_id"),
+    ("color", reference_data.colors, ColorInventory, "color_id"),
+]
+
+
+def stock_rows(product_ids, variant_ids):
+    """
+    {("product", product id, 0): 0} for the existing products and
+    {(field, product id, variant id): quantity} for their variants among
+    `variant_ids` ({field: ids}), in one query.
+    """
+    queries = [
+        # Compound statements don't allow the default orderings
+        Product.objects.filter(pk__in=product_ids)
+        .order_by()
+        .values_list(
+            Value("product"),
+            F("id"),
+            Value(0, output_field=IntegerField()),
+            Value(0, output_field=IntegerField()),
+        )
+    ]
+    for field, _, model, foreign_key in VARIANTS:
+        if variant_ids[field]:
+            queries.append(
+                model.objects.filter(
+                    product_id__in=product_ids,
+                    **{f"{foreign_key}__in": variant_ids[field]},
+                )
+                .order_by()
+                .values_list(
+                    Value(field), F("product_id"), F(foreign_key), F("quantity")
+                )
+            )
+    # Only expressions, so that every query selects its columns in this order
+    rows = queries[0].union(*queries[1:], all=True)
+    return {(kind, product_id, pk): quantity for kind, product_id, pk, quantity in rows}
+
+
+def validate_items(items):
+    """
+    The errors of each item (dicts with `product_id` and optional `size` and
+    `color` names), as one {field: message} dict per item, empty when valid.
+    """
+    errors = [{} for _ in items]
+    variant_ids = {field: set() for field, *_ in VARIANTS}
+    resolved = []
+    for item, item_errors in zip(items, errors):
+        variants = {}
+        for field, cache, *_ in VARIANTS:
+            name = item.get(field)
+            if not name:
+                continue
+            variant = cache.get(name)
+            if variant is None:
+                item_errors[field] = f"Invalid {field} object"
+            else:
+                variants[field] = variant.pk
+                variant_ids[field].add(variant.pk)
+        resolved.append(variants)
+
+    stock = stock_rows({item["product_id"] for item in items}, variant_ids)
+    for item, variants, item_errors in zip(items, resolved, errors):
+        product_id = item["product_id"]
+        if ("product", product_id, 0) not in stock:
+            item_errors["product_id"] = "No product with the given ID was found."
+            continue
+        for field, pk in variants.items():
+            quantity = stock.get((field, product_id, pk))
+            if quantity is None:
+                item_errors[field] = (
+                    f"We don't have that {field} for this specific product!"
+                )
+            elif quantity <= 0:
+                item_errors[field] = (
+                    f"This {field} for this product is no longer in stock!"
+                )
+    return errors
+
+
+def add_items(cart_id, items):
+    """
+    Insert items (dicts with `product_id`, `quantity` and optional `size`,
+    `color` and `hex_code`) in a cart, adding their quantity to the same items
+    already in it, in one statement. Return the items with their new
+    quantities.
+    """
+    # A statement can't update the same row twice, merge repeated items first
+    merged = {}
+    for item in items:
+        size, color = item.get("size") or None, item.get("color") or None
+        key = (item["product_id"], size or "", color or "")
+        if key in merged:
+            merged[key][2] += item["quantity"]
+        else:
+            merged[key] = [
+                cart_id,
+                item["product_id"],
+                item["quantity"],
+                size,
+                color,
+                item.get("hex_code"),
+            ]
+    if not merged:
+        return []
+
+    opts = CartItem._meta
+    qn = connection.ops.quote_name
+    table = qn(opts.db_table)
+    fields = [
+        opts.get_field(name)
+        for name in ["cart", "product", "quantity", "size", "color", "hex_code"]
+    ]
+    params = [
+        field.get_db_prep_value(value, connection)
+        for row in merged.values()
+        for field, value in zip(fields, row)
+    ]
+    placeholders = "(%s)" % ", ".join(["%s"] * len(fields))
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} "
+                f"({', '.join(qn(field.column) for field in fields)}) "
+                f"VALUES {', '.join([placeholders] * len(merged))} "
+                # The expressions of the cart_item_unique constraint
+                f"ON CONFLICT ({qn('cart_id')}, {qn('product_id')}, "
+                f"COALESCE({qn('size')}, ''), COALESCE({qn('color')}, '')) "
+                f"DO UPDATE SET {qn('quantity')} = "
+                f"{table}.{qn('quantity')} + EXCLUDED.{qn('quantity')} "
+                f"RETURNING {qn('id')}, {qn('product_id')}, {qn('quantity')}, "
+                f"{qn('size')}, {qn('color')}, {qn('hex_code')}",
+                params,
+            )
+            rows = cursor.fetchall()
+        # The raw write skips the CartItem signal handlers
+        Cart.objects.filter(pk=cart_id).update(last_update=timezone.now())
+
+    return [
+        CartItem(
+            pk=pk,
+            cart_id=cart_id,
+            product_id=product_id,
+            quantity=quantity,
+            size=size,
+            color=color,
+            hex_code=hex_code,
+        )
+        for pk, product_id, quantity, size, color, hex_code in rows
+    ]
+
+
+def add_item(cart_id, product_id, quantity, size=None, color=None, hex_code=None):
+    """
+    Insert an item in a cart or add `quantity` to the same item already in
+    it, return the item with its new quantity.
+    """
+    (item,) = add_items(
+        cart_id,
+        [
+            {
+                "product_id": product_id,
+                "quantity": quantity,
+                "size": size,
+                "color": color,
+                "hex_code": hex_code,
+            }
+        ],
+    )
+    return item
@@ -0,0 +1,355 @@
+"""
+Bulk import of catalog records from CSV or NDJSON files.
+
+A record describes one product:
+
+    {"id": 12, "title": "Runner", "description": "...", "unit_price": "59.90",
+     "inventory": 10, "is_digital": false, "url": null, "collection": "Shoes",
+     "images": ["store/images/runner.jpg"],
+     "sizes": [{"size": "XL", "quantity": 2, "extra_price": "1.50"}],
+     "colors": [{"name": "Red", "hex_code": "#ff0000", "quantity": 3}]}
+
+`collection` is a collection title. A record with the `id` of an existing
+product updates it, any other record creates a product. `sizes` and
+`colors`, when present, replace the variants of the product and `images`
+adds the image files the product doesn't have yet. In CSV files the
+`images`, `sizes` and `colors` cells hold the same lists as JSON.
+
+Records are written in chunks, each in its own transaction with
+`bulk_create` / `bulk_update` and one query per table, rather than with
+per-row saves. The collection, color and size reference rows are kept in
+memory maps and only the missing ones are inserted. Bulk writes skip the
+model signals, so each chunk updates the stored stock, collection counts,
+search index and color / size caches itself, and the response cache and
+autocomplete indexes are invalidated once the chunk is committed.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from shop import cache as catalog_cache
+from shop import reference_data, search
+from shop.autocomplete import title_index
+from shop.models import (
+    Collection,
+    Color,
+    ColorInventory,
+    Product,
+    ProductImage,
+    Size,
+    SizeInventory,
+)
+
+PRODUCT_FIELDS = [
+    "title",
+    "description",
+    "unit_price",
+    "inventory",
+    "is_digital",
+    "url",
+    "collection_id",
+]
+LIST_COLUMNS = ["images", "sizes", "colors"]
+TRUE_VALUES = {"1", "true", "yes", "y", "t"}
+
+
+class CatalogImportError(ValueError):
+    def __init__(self, line, message):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+def read_ndjson(path):
+    with open(path, encoding="utf-8") as source:
+        for line, text in enumerate(source, start=1):
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except ValueError as error:
+                raise CatalogImportError(line, f"Invalid JSON ({error})")
+
+
+def read_csv(path):
+    with open(path, encoding="utf-8", newline="") as source:
+        reader = csv.DictReader(source)
+        # The header is line 1
+        for line, row in enumerate(reader, start=2):
+            record = {key: value for key, value in row.items() if value != ""}
+            for column in LIST_COLUMNS:
+                if column in record:
+                    try:
+                        record[column] = json.loads(record[column])
+                    except ValueError as error:
+                        raise CatalogImportError(
+                            line, f"Invalid JSON in {column} ({error})"
+                        )
+            yield line, record
+
+
+def read_records(path, file_format=None):
+    """(line number, record) pairs of a .csv or .ndjson/.jsonl file."""
+    if file_format is None:
+        file_format = "csv" if str(path).lower().endswith(".csv") else "ndjson"
+    if file_format == "csv":
+        return read_csv(path)
+    return read_ndjson(path)
+
+
+def parse_decimal(line, value, name, required=False):
+    if value is None:
+        if required:
+            raise CatalogImportError(line, f"{name} is required")
+        return None
+    try:
+        return Decimal(str(value)).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        raise CatalogImportError(line, f"Invalid {name}: {value}")
+
+
+def parse_int(line, value, name, default=0):
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise CatalogImportError(line, f"Invalid {name}: {value}")
+
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
+
+class CatalogImporter:
+    """Imports chunks of records, see `import_chunk()`."""
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.load_references()
+
+    def load_references(self):
+        self.collections = {}
+        for pk, title in Collection.objects.order_by("-pk").values_list("pk", "title"):
+            # The oldest collection wins when titles are duplicated
+            self.collections[title] = pk
+        self.colors = {color.name: color for color in Color.objects.all()}
+        self.sizes = {size.size: size for size in Size.objects.all()}
+
+    def clean(self, line, record):
+        if not isinstance(record, dict):
+            raise CatalogImportError(line, "A record must be an object")
+        title = record.get("title")
+        if not title:
+            raise CatalogImportError(line, "title is required")
+        collection = record.get("collection")
+        if not collection:
+            raise CatalogImportError(line, "collection is required")
+
+        cleaned = {
+            "line": line,
+            "id": parse_int(line, record.get("id"), "id", default=None),
+            "collection": str(collection),
+            "fields": {
+                "title": title,
+                "description": record.get("description"),
+                "unit_price": parse_decimal(
+                    line, record.get("unit_price"), "unit_price", required=True
+                ),
+                "inventory": parse_int(line, record.get("inventory"), "inventory"),
+                "is_digital": parse_bool(record.get("is_digital", False)),
+                "url": record.get("url"),
+            },
+        }
+        for column in LIST_COLUMNS:
+            if column in record:
+                if not isinstance(record[column], list):
+                    raise CatalogImportError(line, f"{column} must be a list")
+                if column != "images" and not all(
+                    isinstance(variant, dict) for variant in record[column]
+                ):
+                    raise CatalogImportError(line, f"{column} must hold objects")
+                cleaned[column] = record[column]
+        return cleaned
+
+    def upsert_references(self, records):
+        """
+        Insert the collections, colors and sizes the records refer to, return
+        the colors whose hex code changed.
+        """
+        titles = {record["collection"] for record in records} - set(self.collections)
+        for collection in Collection.objects.bulk_create(
+            [Collection(title=title) for title in sorted(titles)]
+        ):
+            self.collections[collection.title] = collection.pk
+
+        new_colors, changed_colors = {}, {}
+        for record in records:
+            for variant in record.get("colors", []):
+                name, hex_code = variant.get("name"), variant.get("hex_code")
+                if not name:
+                    raise CatalogImportError(record["line"], "A color needs a name")
+                color = self.colors.get(name) or new_colors.get(name)
+                if color is None:
+                    new_colors[name] = Color(name=name, hex_code=hex_code)
+                elif hex_code and color.hex_code != hex_code:
+                    color.hex_code = hex_code
+                    if color.pk:
+                        changed_colors[name] = color
+        for color in Color.objects.bulk_create(list(new_colors.values())):
+            self.colors[color.name] = color
+        Color.objects.bulk_update(list(changed_colors.values()), ["hex_code"])
+        if new_colors or changed_colors:
+            reference_data.colors.invalidate()
+
+        sizes = set()
+        for record in records:
+            for variant in record.get("sizes", []):
+                if not variant.get("size"):
+                    raise CatalogImportError(record["line"], "A size needs a name")
+                sizes.add(str(variant["size"]))
+        new_sizes = Size.objects.bulk_create(
+            [Size(size=size) for size in sorted(sizes - set(self.sizes))]
+        )
+        for size in new_sizes:
+            self.sizes[size.size] = size
+        if new_sizes:
+            reference_data.sizes.invalidate()
+        return list(changed_colors.values())
+
+    def write_products(self, records):
+        existing = Product.objects.in_bulk(
+            [record["id"] for record in records if record["id"] is not None]
+        )
+        # Collections the products are added to or moved out of
+        collection_ids = {product.collection_id for product in existing.values()}
+        now = timezone.now()
+        to_create, to_update = [], []
+        for record in records:
+            fields = dict(
+                record["fields"], collection_id=self.collections[record["collection"]]
+            )
+            product = existing.get(record["id"])
+            if product is None:
+                product = Product(**fields)
+                to_create.append(product)
+            else:
+                for name, value in fields.items():
+                    setattr(product, name, value)
+                # bulk_update() doesn't apply auto_now
+                product.last_update = now
+                to_update.append(product)
+            record["product"] = product
+
+        collection_ids.update(
+            product.collection_id for product in to_create + to_update
+        )
+        Product.objects.bulk_create(to_create)
+        Product.objects.bulk_update(to_update, PRODUCT_FIELDS + ["last_update"])
+        # Bulk writes skip the Product signal handlers keeping the counts
+        Collection.objects.filter(pk__in=collection_ids).rebuild_products_count()
+        self.created += len(to_create)
+        self.updated += len(to_update)
+        return [product.pk for product in to_update]
+
+    def write_variants(self, records):
+        sized = [record for record in records if "sizes" in record]
+        SizeInventory.objects.filter(
+            product__in=[record["product"] for record in sized]
+        ).delete()
+        SizeInventory.objects.bulk_create(
+            [
+                SizeInventory(
+                    product=record["product"],
+                    size=self.sizes[str(variant["size"])],
+                    quantity=parse_int(
+                        record["line"], variant.get("quantity"), "quantity"
+                    ),
+                    extra_price=parse_decimal(
+                        record["line"], variant.get("extra_price"), "extra_price"
+                    ),
+                )
+                for record in sized
+                for variant in record["sizes"]
+            ]
+        )
+
+        colored = [record for record in records if "colors" in record]
+        ColorInventory.objects.filter(
+            product__in=[record["product"] for record in colored]
+        ).delete()
+        ColorInventory.objects.bulk_create(
+            [
+                ColorInventory(
+                    product=record["product"],
+                    color=self.colors[variant["name"]],
+                    quantity=parse_int(
+                        record["line"], variant.get("quantity"), "quantity"
+                    ),
+                    extra_price=parse_decimal(
+                        record["line"], variant.get("extra_price"), "extra_price"
+                    ),
+                )
+                for record in colored
+                for variant in record["colors"]
+            ]
+        )
+
+    def write_images(self, records):
+        with_images = [record for record in records if record.get("images")]
+        existing = set(
+            ProductImage.objects.filter(
+                product__in=[record["product"] for record in with_images]
+            ).values_list("product_id", "image")
+        )
+        images = []
+        for record in with_images:
+            for name in record["images"]:
+                key = (record["product"].pk, str(name))
+                if key not in existing:
+                    existing.add(key)
+                    images.append(ProductImage(product=record["product"], image=name))
+        ProductImage.objects.bulk_create(images)
+
+    def import_chunk(self, chunk):
+        """
+        Write a list of (line number, record) pairs in one transaction, the
+        whole chunk is rolled back when one of its records is invalid.
+        """
+        records = [self.clean(line, record) for line, record in chunk]
+        created, updated = self.created, self.updated
+        try:
+            with transaction.atomic():
+                changed_colors = self.upsert_references(records)
+                updated_ids = self.write_products(records)
+                # Bulk updates skip the Color signal handlers
+                recolored_ids = list(
+                    ColorInventory.objects.filter(
+                        color__in=changed_colors
+                    ).values_list("product_id", flat=True)
+                )
+                Product.objects.filter(pk__in=recolored_ids).update(
+                    last_update=timezone.now()
+                )
+                updated_ids += recolored_ids
+                self.write_variants(records)
+                self.write_images(records)
+                product_ids = [record["product"].pk for record in records]
+                Product.objects.filter(pk__in=product_ids).rebuild_stock()
+                search.index_products(product_ids)
+        except Exception:
+            # Forget the rows of the rolled back transaction
+            self.load_references()
+            self.created, self.updated = created, updated
+            raise
+
+        if updated_ids:
+            catalog_cache.invalidate_products(updated_ids)
+        else:
+            catalog_cache.invalidate_catalog()
+        title_index.invalidate()
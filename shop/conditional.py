@@ -0,0 +1,105 @@
+"""
+ETag and Last-Modified validators of the catalog and cart endpoints.
+
+Validators are derived from a single query per endpoint, without building
+the response body, so a client sending `If-None-Match` or
+`If-Modified-Since` gets its 304 before any serialization happens. Related
+rows (images, inventories, reviews, cart items) touch the `last_update` of
+their parent from the signal handlers to keep these queries meaningful.
+
+List responses only get an ETag: the latest `last_update` of a list doesn't
+move when a row is deleted or the list is reordered, so it can't serve as
+their Last-Modified. The product list ETag is built from the catalog version
+of `shop.cache`, bumped by every write the cached lists depend on, rather
+than from an aggregate over the whole filtered catalog.
+"""
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework import status
+
+from shop.cache import CATALOG_VERSION_KEY, get_versions, request_fingerprint
+from shop.models import Cart, Collection, Product
+
+
+def make_etag(request, *parts):
+    # The representation also depends on the query string, the media type and
+    # the user the `is_liked` flags are set for
+    raw = repr(
+        (
+            request_fingerprint(request),
+            request.accepted_media_type,
+            request.user.pk,
+            parts,
+        )
+    )
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def product_validators(request, product_id):
+    try:
+        row = (
+            Product.objects.filter(pk=product_id)
+            .values_list("last_update", "likes_count")
+            .first()
+        )
+    except (ValueError, ValidationError):
+        row = None
+    if row is None:
+        return None, None
+    last_update, likes_count = row
+    return make_etag(request, product_id, last_update, likes_count), last_update
+
+
+def product_list_validators(request):
+    # The query string is part of the ETag, so every filter, ordering and page
+    # has its own
+    (version,) = get_versions([CATALOG_VERSION_KEY])
+    return make_etag(request, version), None
+
+
+def collection_list_validators(request):
+    # Changing the stored products_count of a collection touches it too
+    collections = Collection.objects.aggregate(
+        total=Count("id"), last_update=Max("last_update")
+    )
+    return make_etag(request, collections), None
+
+
+def cart_validators(request, cart_id):
+    try:
+        stats = Cart.objects.filter(pk=cart_id).aggregate(
+            last_update=Max("last_update"),
+            products_update=Max("items__product__last_update"),
+        )
+    except (ValueError, ValidationError):
+        return None, None
+    if stats["last_update"] is None:
+        return None, None
+    last_modified = max(filter(None, stats.values()))
+    return make_etag(request, cart_id, stats), last_modified
+
+
+def conditional_response(request, etag, last_modified, get_response):
+    """
+    Answer 304 when the request validators match, otherwise build the
+    response with `get_response()` and attach the validators to it.
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+
+    not_modified = get_conditional_response(
+        request._request, etag=etag, last_modified=timestamp
+    )
+    if not_modified is not None:
+        return not_modified
+
+    response = get_response()
+    if response.status_code == status.HTTP_200_OK:
+        if etag:
+            response["ETag"] = etag
+        if timestamp:
+            response["Last-Modified"] = http_date(timestamp)
+    return response
@@ -0,0 +1,75 @@
+"""
+NDJSON export of the product catalog, one product per line with its variants
+and image URLs.
+
+Products are read in keyset chunks of primary keys, each chunk rendered with
+one query per relation by the fast read path, so memory stays constant
+whatever the size of the catalog and no transaction is held open while a
+slow client consumes the stream.
+"""
+import json
+from datetime import datetime, time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from shop import fast_serializers
+from shop.models import Product
+
+EXPORT_FIELDS = [
+    "id",
+    "title",
+    "description",
+    "is_digital",
+    "inventory",
+    "unit_price",
+    "collection",
+    "product_url",
+    "images",
+    "colors",
+    "sizes",
+]
+
+
+def parse_updated_since(value):
+    """
+    The datetime of an ISO 8601 date or datetime, the current time zone
+    applying to naive ones. Raises ValueError when `value` is neither.
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_products(updated_since=None, chunk_size=500, request=None):
+    """Yield the NDJSON lines of the products updated since `updated_since`."""
+    products = Product.objects.order_by("pk")
+    if updated_since is not None:
+        products = products.filter(last_update__gte=updated_since)
+
+    last_pk = 0
+    while True:
+        rows = list(
+            fast_serializers.product_rows(
+                products.filter(pk__gt=last_pk),
+                EXPORT_FIELDS,
+                extra_columns=["last_update"],
+            )[:chunk_size]
+        )
+        if not rows:
+            return
+
+        for row, product in zip(
+            rows, fast_serializers.render_products(rows, request, EXPORT_FIELDS)
+        ):
+            product["last_update"] = row["last_update"]
+            yield json.dumps(product, cls=DjangoJSONEncoder) + "\n"
+
+        last_pk = rows[-1]["id"]
@@ -0,0 +1,83 @@
+"""
+Facet counts of the product catalog.
+
+Each facet is one grouped aggregate query over the products matching the
+current filters, except the facet's own filter so the client can still offer
+the other values of that facet (e.g. the counts of every color while `color`
+is already filtered).
+"""
+from django.db.models import Count, Q
+
+from .models import ColorInventory, SizeInventory
+
+# Lower bounds of the price buckets, the last one is open-ended
+PRICE_BUCKETS = [0, 25, 50, 100, 200, 500]
+
+
+def collection_facet(products):
+    rows = (
+        products.order_by()
+        .values("collection_id", "collection__title")
+        .annotate(count=Count("id"))
+        .order_by("-count", "collection__title")
+    )
+    return [
+        {
+            "id": row["collection_id"],
+            "title": row["collection__title"],
+            "count": row["count"],
+        }
+        for row in rows
+    ]
+
+
+def color_facet(products):
+    rows = (
+        ColorInventory.objects.filter(product__in=products.order_by().values("pk"))
+        .values("color__name", "color__hex_code")
+        .annotate(count=Count("product", distinct=True))
+        .order_by("-count", "color__name")
+    )
+    return [
+        {
+            "name": row["color__name"],
+            "hex_code": row["color__hex_code"],
+            "count": row["count"],
+        }
+        for row in rows
+    ]
+
+
+def size_facet(products):
+    rows = (
+        SizeInventory.objects.filter(product__in=products.order_by().values("pk"))
+        .values("size__size")
+        .annotate(count=Count("product", distinct=True))
+        .order_by("-count", "size__size")
+    )
+    return [{"size": row["size__size"], "count": row["count"]} for row in rows]
+
+
+def price_facet(products, buckets=PRICE_BUCKETS):
+    ranges = list(zip(buckets, buckets[1:] + [None]))
+    aggregates = {}
+    for index, (low, high) in enumerate(ranges):
+        condition = Q(unit_price__gte=low)
+        if high is not None:
+            condition &= Q(unit_price__lt=high)
+        aggregates[f"bucket_{index}"] = Count("id", filter=condition)
+
+    counts = products.order_by().aggregate(**aggregates)
+    return [
+        {"min_price": low, "max_price": high, "count": counts[f"bucket_{index}"]}
+        for index, (low, high) in enumerate(ranges)
+    ]
+
+
+# Facet name -> (count function, query parameters of its own filter)
+FACETS = {
+    "collections": (collection_facet, ["collection_id"]),
+    "colors": (color_facet, ["color"]),
+    "sizes": (size_facet, ["size"]),
+    "price_ranges": (price_facet, ["min_price", "max_price"]),
+}
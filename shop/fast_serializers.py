@@ -0,0 +1,231 @@
+"""
+Read-only fast path of the catalog payloads.
+
+Builds the exact JSON shapes of ProductSerializer, SimpleProductSerializer and
+CartItemSerializer from `values()` rows and per-page lookup dicts, without
+instantiating models or serializers per row. The DRF serializers remain the
+reference implementation and are still used for every write;
+`shop.tests.FastSerializerEquivalenceTest` keeps both in step and the
+`benchmark_serializers` command compares their throughput.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from .models import (
+    CartItem,
+    ColorInventory,
+    Product,
+    ProductImage,
+    SizeInventory,
+)
+from .pricing import CartPricing
+from .serializers import ProductSerializer, color_hex_code
+
+CENTS = Decimal("0.01")
+
+# Product field -> columns it is rendered from
+PRODUCT_COLUMNS = {
+    "id": ["id"],
+    "title": ["title"],
+    "description": ["description"],
+    "is_digital": ["is_digital"],
+    "inventory": ["inventory"],
+    "unit_price": ["unit_price"],
+    "collection": ["collection_id"],
+    "rating": ["review_count", "average_rating"],
+    "total_review": ["review_count"],
+    "variant_stock": ["variant_stock"],
+    "total_available": ["total_available"],
+    "in_stock": ["in_stock"],
+    "likes_count": ["likes_count"],
+    # Depends on the user, set after the cache by ProductViewSet.mark_liked()
+    "is_liked": [],
+    "product_url": ["is_digital", "url"],
+}
+
+SIMPLE_PRODUCT_FIELDS = ["id", "title", "unit_price", "rating", "product_url", "images"]
+
+
+def money(value):
+    if value is None:
+        return None
+    return value.quantize(CENTS)
+
+
+def image_url(name, request=None):
+    if not name:
+        return None
+    url = ProductImage._meta.get_field("image").storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def images_by_product(product_ids, request=None):
+    images = defaultdict(list)
+    rows = (
+        ProductImage.objects.filter(product_id__in=product_ids)
+        .order_by("id")
+        .values_list("product_id", "id", "image")
+    )
+    for product_id, pk, name in rows:
+        images[product_id].append({"id": pk, "image": image_url(name, request)})
+    return images
+
+
+def sizes_by_product(product_ids):
+    sizes = defaultdict(list)
+    rows = (
+        SizeInventory.objects.filter(product_id__in=product_ids)
+        .order_by("id")
+        .values_list("product_id", "quantity", "extra_price", "size__size")
+    )
+    for product_id, quantity, extra_price, size in rows:
+        sizes[product_id].append(
+            {
+                "quantity": quantity,
+                "extra_price": money(extra_price),
+                "size": {"size": size},
+            }
+        )
+    return sizes
+
+
+def colors_by_product(product_ids):
+    colors = defaultdict(list)
+    rows = (
+        ColorInventory.objects.filter(product_id__in=product_ids)
+        .order_by("id")
+        .values_list(
+            "product_id", "quantity", "extra_price", "color__name", "color__hex_code"
+        )
+    )
+    for product_id, quantity, extra_price, name, hex_code in rows:
+        colors[product_id].append(
+            {
+                "quantity": quantity,
+                "extra_price": money(extra_price),
+                "color": {"name": name, "hex_code": hex_code},
+            }
+        )
+    return colors
+
+
+def product_rows(queryset, fields=None, extra_columns=()):
+    """
+    `queryset` as `values()` rows holding the columns needed to render
+    `fields` (every ProductSerializer field by default) plus `extra_columns`,
+    e.g. the ones a keyset cursor is built from. The result can be paginated
+    like the queryset itself.
+    """
+    fields = fields or ProductSerializer.Meta.fields
+    columns = {"id", *extra_columns}
+    for name in fields:
+        columns.update(PRODUCT_COLUMNS.get(name, []))
+    return queryset.prefetch_related(None).values(*sorted(columns))
+
+
+def render_products(rows, request=None, fields=None):
+    """ProductSerializer output for rows of `product_rows()`."""
+    fields = fields or ProductSerializer.Meta.fields
+    rows = list(rows)
+    product_ids = [row["id"] for row in rows]
+
+    relations = {}
+    if "images" in fields:
+        relations["images"] = images_by_product(product_ids, request)
+    if "sizes" in fields:
+        relations["sizes"] = sizes_by_product(product_ids)
+    if "colors" in fields:
+        relations["colors"] = colors_by_product(product_ids)
+
+    return [render_product(row, fields, relations) for row in rows]
+
+
+def render_product(row, fields, relations):
+    data = {}
+    for name in fields:
+        if name in relations:
+            data[name] = relations[name].get(row["id"], [])
+        elif name == "collection":
+            data[name] = row["collection_id"]
+        elif name == "unit_price":
+            data[name] = money(row["unit_price"])
+        elif name == "rating":
+            data[name] = row["average_rating"] if row["review_count"] >= 1 else 1.0
+        elif name == "total_review":
+            data[name] = max(row["review_count"], 1)
+        elif name == "is_liked":
+            # Set for the current user by ProductViewSet.mark_liked()
+            data[name] = False
+        elif name == "product_url":
+            data[name] = row["url"] if row["is_digital"] else None
+        else:
+            data[name] = row[name]
+    return data
+
+
+def render_simple_products(rows, request=None):
+    """SimpleProductSerializer output, which keeps the first image only."""
+    products = render_products(rows, request, SIMPLE_PRODUCT_FIELDS)
+    for product in products:
+        product["images"] = product["images"][:1]
+    return products
+
+
+def render_cart(cart_id, request=None):
+    """CartSerializer output."""
+    items = priced_cart_items(cart_id, request)
+    return {
+        "id": str(cart_id),
+        "items": [item for item, _ in items],
+        "cart_total_price": sum(resolved_price for _, resolved_price in items),
+    }
+
+
+def render_cart_items(cart_id, request=None):
+    """CartItemSerializer output of every item in the cart."""
+    return [item for item, _ in priced_cart_items(cart_id, request)]
+
+
+def priced_cart_items(cart_id, request=None):
+    """(CartItemSerializer output, line total) of the cart items."""
+    items = list(
+        CartItem.objects.filter(cart_id=cart_id)
+        .order_by("id")
+        .values("id", "product_id", "quantity", "size", "color")
+    )
+    product_ids = {item["product_id"] for item in items}
+
+    products = {
+        product["id"]: product
+        for product in render_simple_products(
+            product_rows(
+                Product.objects.filter(pk__in=product_ids), SIMPLE_PRODUCT_FIELDS
+            ),
+            request,
+        )
+    }
+    pricing = CartPricing(product_ids)
+
+    priced = []
+    for item in items:
+        product = products[item["product_id"]]
+        line_total = pricing.line_total(
+            item["product_id"],
+            product["unit_price"],
+            item["quantity"],
+            item["size"],
+            item["color"],
+        )
+        data = {
+            "id": item["id"],
+            "product": product,
+            "quantity": item["quantity"],
+            "size": item["size"],
+            "color": item["color"],
+            "hex_code": color_hex_code(item["color"]),
+            "total_price": line_total,
+        }
+        priced.append((data, line_total))
+    return priced
@@ -1,13 +1,49 @@
-from django_filters.rest_framework import FilterSet
+from django.db.models import Exists, OuterRef
+from django_filters.rest_framework import (
+    BaseInFilter,
+    BooleanFilter,
+    CharFilter,
+    FilterSet,
+    NumberFilter,
+)
 
-from .models import Product
+from .models import ColorInventory, Product, SizeInventory
+
+
+class CharInFilter(BaseInFilter, CharFilter):
+    pass
 
 
 class ProductFilter(FilterSet):
+    # Variant filters are EXISTS subqueries so a product matching several
+    # colors or sizes is still listed once
+    color = CharInFilter(method="filter_color", help_text="Comma separated color names")
+    size = CharInFilter(method="filter_size", help_text="Comma separated sizes")
+    # A plain number rather than a model choice, validating it would cost a query
+    collection_id = NumberFilter(field_name="collection_id")
+    min_price = NumberFilter(field_name="unit_price", lookup_expr="gte")
+    max_price = NumberFilter(field_name="unit_price", lookup_expr="lte")
+    # Stored by ProductQuerySet.rebuild_stock(), behind partial indexes
+    in_stock = BooleanFilter(field_name="in_stock")
+
     class Meta:
         model = Product
-        fields = {
-            'collection_id': ['exact'],
-            # 'colors__name': ['exact'],
-            # 'sizes__size': ['exact']
-        }
+        fields = ["collection_id", "is_digital"]
+
+    def filter_color(self, queryset, name, value):
+        return queryset.filter(
+            Exists(
+                ColorInventory.objects.filter(
+                    product=OuterRef("pk"), color__name__in=value
+                )
+            )
+        )
+
+    def filter_size(self, queryset, name, value):
+        return queryset.filter(
+            Exists(
+                SizeInventory.objects.filter(
+                    product=OuterRef("pk"), size__size__in=value
+                )
+            )
+        )
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import fast_serializers
+from shop.serializers import ProductSerializer
+from shop.views import product_listing_queryset
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the throughput of ProductSerializer and the fast read path "
+        "over the first products of the catalog"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        queryset = product_listing_queryset().order_by("pk")[: options["products"]]
+        count = queryset.count()
+        if not count:
+            self.stdout.write(self.style.WARNING("No products to serialize."))
+            return
+
+        # Both include their queries, a fresh queryset is evaluated every time
+        def drf():
+            ProductSerializer(queryset.all(), many=True).data
+
+        def fast():
+            fast_serializers.render_products(
+                fast_serializers.product_rows(queryset.all())
+            )
+
+        for name, serialize in [("ProductSerializer", drf), ("fast path", fast)]:
+            serialize()  # warm up
+            started = time.perf_counter()
+            for _ in range(options["repeat"]):
+                serialize()
+            elapsed = (time.perf_counter() - started) / options["repeat"]
+            self.stdout.write(
+                f"{name}: {elapsed * 1000:.2f} ms per page of {count} products, "
+                f"{count / elapsed:.0f} products/s"
+            )
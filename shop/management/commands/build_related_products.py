@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from shop import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the "customers also bought" products from the orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--window-hours",
+            type=float,
+            default=recommendations.DEFAULT_WINDOW.total_seconds() / 3600,
+            help="Orders of a customer this close to each other form one basket",
+        )
+        parser.add_argument("--top-k", type=int, default=recommendations.DEFAULT_TOP_K)
+        parser.add_argument(
+            "--min-count",
+            type=int,
+            default=1,
+            help="Least number of baskets two products must share",
+        )
+
+    def handle(self, *args, **options):
+        products = recommendations.build_related_products(
+            window=timedelta(hours=options["window_hours"]),
+            top_k=options["top_k"],
+            min_count=options["min_count"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Stored related products of {products} products.")
+        )
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import export
+
+
+class Command(BaseCommand):
+    help = "Export the product catalog as NDJSON, one product per line"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output", help="File to write to, the standard output by default"
+        )
+        parser.add_argument(
+            "--updated-since",
+            help="Only export the products updated since this ISO 8601 date",
+        )
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        updated_since = options["updated_since"]
+        if updated_since is not None:
+            try:
+                updated_since = export.parse_updated_since(updated_since)
+            except ValueError as error:
+                raise CommandError(error)
+
+        lines = export.export_products(updated_since, options["chunk_size"])
+        if options["output"] is None:
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+
+        exported = 0
+        with open(options["output"], "w") as output:
+            for line in lines:
+                output.write(line)
+                exported += 1
+        self.stdout.write(self.style.SUCCESS(f"Exported {exported} products."))
@@ -0,0 +1,59 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_import import CatalogImporter, CatalogImportError, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Import products with their sizes, colors and images from a CSV or "
+        "NDJSON file, see shop.catalog_import for the record format"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "ndjson"])
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--checkpoint",
+            help="File recording the last committed line, an interrupted "
+            "import started again with the same file resumes after it",
+        )
+
+    def handle(self, *args, **options):
+        checkpoint = options["checkpoint"]
+        resume_after = 0
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as source:
+                resume_after = int(source.read().strip() or 0)
+            self.stdout.write(f"Resuming after line {resume_after}.")
+
+        importer = CatalogImporter()
+        chunk = []
+        try:
+            for line, record in read_records(options["path"], options["format"]):
+                if line <= resume_after:
+                    continue
+                chunk.append((line, record))
+                if len(chunk) == options["chunk_size"]:
+                    self.import_chunk(importer, chunk, checkpoint)
+                    chunk = []
+            self.import_chunk(importer, chunk, checkpoint)
+        except CatalogImportError as error:
+            raise CommandError(f"{error}, the chunk holding it was rolled back")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {importer.created} and updated {importer.updated} products."
+            )
+        )
+
+    def import_chunk(self, importer, chunk, checkpoint):
+        if not chunk:
+            return
+        importer.import_chunk(chunk)
+        if checkpoint:
+            with open(checkpoint, "w") as output:
+                output.write(str(chunk[-1][0]))
+        self.stdout.write(f"Committed up to line {chunk[-1][0]}.")
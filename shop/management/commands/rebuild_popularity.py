@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from shop import cache as catalog_cache
+from shop.popularity import rebuild_popularity
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the popularity score of products from their likes, reviews and "
+        "orders"
+    )
+
+    def handle(self, *args, **options):
+        updated = rebuild_popularity()
+        catalog_cache.invalidate_catalog()
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt the popularity of {updated} products.")
+        )
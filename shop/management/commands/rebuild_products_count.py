@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from shop import cache as catalog_cache
+from shop.models import Collection
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored product count of collections"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "collection_ids", nargs="*", type=int, help="Only rebuild these collections"
+        )
+
+    def handle(self, *args, **options):
+        collections = Collection.objects.all()
+        if options["collection_ids"]:
+            collections = collections.filter(pk__in=options["collection_ids"])
+
+        updated = collections.rebuild_products_count()
+        catalog_cache.invalidate_catalog()
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt the product count of {updated} collections.")
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from shop import cache as catalog_cache
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the stored review count, rating sum, average rating and star "
+        "histogram of products"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "product_ids", nargs="*", type=int, help="Only rebuild these products"
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options["product_ids"]:
+            products = products.filter(pk__in=options["product_ids"])
+
+        updated = products.rebuild_rating_stats()
+        catalog_cache.invalidate_products(products.values_list("pk", flat=True))
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt rating stats of {updated} products.")
+        )
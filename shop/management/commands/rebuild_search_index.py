@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from shop import search
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search documents of all products"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        product_ids = Product.objects.order_by("pk").values_list("pk", flat=True)
+
+        chunk, indexed = [], 0
+        for product_id in product_ids.iterator(chunk_size=chunk_size):
+            chunk.append(product_id)
+            if len(chunk) == chunk_size:
+                search.index_products(chunk)
+                indexed += len(chunk)
+                chunk = []
+        search.index_products(chunk)
+        indexed += len(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} products."))
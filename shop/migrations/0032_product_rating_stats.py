@@ -0,0 +1,53 @@
+# Generated by Django 4.2 on 2023-04-20 10:12
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_rating_stats(apps, schema_editor):
+    Product = apps.get_model("shop", "Product")
+    Review = apps.get_model("shop", "Review")
+
+    reviews = Review.objects.filter(product=OuterRef("pk")).order_by().values("product")
+    Product.objects.update(
+        review_count=Coalesce(
+            Subquery(reviews.annotate(total=Count("id")).values("total")), 0
+        ),
+        rating_sum=Coalesce(
+            Subquery(reviews.annotate(total=Sum("rating")).values("total")), 0
+        ),
+        average_rating=Coalesce(
+            Subquery(
+                reviews.annotate(
+                    average=Avg("rating", output_field=FloatField())
+                ).values("average")
+            ),
+            0.0,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0031_alter_order_customer_alter_order_product_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="average_rating",
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_sum",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="review_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_rating_stats, migrations.RunPython.noop),
+    ]
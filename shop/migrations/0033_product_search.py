@@ -0,0 +1,51 @@
+# Generated by Django 4.2 on 2023-04-21 09:30
+
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE shop_product_fts USING fts5("
+    "title, description, collection, tokenize = 'unicode61 remove_diacritics 2')",
+    "INSERT INTO shop_product_fts (rowid, title, description, collection) "
+    "SELECT p.id, p.title, COALESCE(p.description, ''), c.title "
+    "FROM shop_product p INNER JOIN shop_collection c ON c.id = p.collection_id",
+]
+SQLITE_BACKWARD = ["DROP TABLE IF EXISTS shop_product_fts"]
+
+POSTGRES_FORWARD = [
+    "CREATE TABLE shop_product_search ("
+    "product_id bigint PRIMARY KEY REFERENCES shop_product (id) "
+    "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "title text NOT NULL, description text NOT NULL, document tsvector NOT NULL)",
+    "CREATE INDEX shop_product_search_document_idx "
+    "ON shop_product_search USING GIN (document)",
+    "INSERT INTO shop_product_search (product_id, title, description, document) "
+    "SELECT p.id, p.title, COALESCE(p.description, ''), "
+    "setweight(to_tsvector('simple', p.title), 'A') || "
+    "setweight(to_tsvector('simple', c.title), 'B') || "
+    "setweight(to_tsvector('simple', COALESCE(p.description, '')), 'C') "
+    "FROM shop_product p INNER JOIN shop_collection c ON c.id = p.collection_id",
+]
+POSTGRES_BACKWARD = ["DROP TABLE IF EXISTS shop_product_search"]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0032_product_rating_stats"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRES_FORWARD}),
+            run_for_vendor(
+                {"sqlite": SQLITE_BACKWARD, "postgresql": POSTGRES_BACKWARD}
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2023-04-24 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0034_keyset_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cart",
+            name="last_update",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="collection",
+            name="last_update",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
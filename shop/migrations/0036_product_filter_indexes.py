@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2023-04-26 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0035_collection_cart_last_update"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="colorinventory",
+            index=models.Index(
+                fields=["color", "product"], name="color_inventory_product_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["collection", "unit_price"], name="product_collection_price_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["is_digital", "unit_price"], name="product_digital_price_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["inventory"], name="product_inventory_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="sizeinventory",
+            index=models.Index(
+                fields=["size", "product"], name="size_inventory_product_idx"
+            ),
+        ),
+    ]
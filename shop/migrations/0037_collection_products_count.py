@@ -0,0 +1,34 @@
+# Generated by Django 4.2 on 2023-04-27 09:40
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_products_count(apps, schema_editor):
+    Collection = apps.get_model("shop", "Collection")
+    Product = apps.get_model("shop", "Product")
+
+    products = (
+        Product.objects.filter(collection=OuterRef("pk"))
+        .order_by()
+        .values("collection")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    Collection.objects.update(products_count=Coalesce(Subquery(products), 0))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0036_product_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="collection",
+            name="products_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_products_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2 on 2023-04-28 11:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0037_collection_products_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RelatedProduct",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("rank", models.PositiveSmallIntegerField()),
+                ("score", models.FloatField()),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="related_products",
+                        to="shop.product",
+                    ),
+                ),
+                (
+                    "related",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="related_to",
+                        to="shop.product",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["product", "rank"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="relatedproduct",
+            constraint=models.UniqueConstraint(
+                fields=("product", "rank"), name="related_product_rank_unique"
+            ),
+        ),
+    ]
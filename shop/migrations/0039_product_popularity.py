@@ -0,0 +1,66 @@
+# Generated by Django 4.2 on 2023-04-29 10:20
+
+import math
+from collections import defaultdict
+from datetime import datetime, time, timezone
+
+from django.db import migrations, models
+
+# Same as shop.popularity at the time of this migration
+LANDMARK = datetime(2023, 1, 1, tzinfo=timezone.utc)
+DECAY_RATE = math.log(2) / (7 * 24 * 3600)
+WEIGHTS = {"like": 1.0, "review": 2.0, "order": 3.0}
+
+
+def boost(weight, at):
+    return weight * math.exp(DECAY_RATE * (at - LANDMARK).total_seconds())
+
+
+def backfill_popularity(apps, schema_editor):
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    Like = apps.get_model("likes", "Like")
+    Order = apps.get_model("shop", "Order")
+    Product = apps.get_model("shop", "Product")
+    Review = apps.get_model("shop", "Review")
+
+    scores = defaultdict(float)
+    likes = Like.objects.filter(
+        content_type__in=ContentType.objects.filter(app_label="shop", model="product")
+    )
+    for product_id, created_at in likes.values_list("object_id", "created_at"):
+        scores[product_id] += boost(WEIGHTS["like"], created_at)
+    for product_id, date in Review.objects.values_list("product_id", "date"):
+        at = datetime.combine(date, time.min, tzinfo=timezone.utc)
+        scores[product_id] += boost(WEIGHTS["review"], at)
+    orders = Order.objects.values_list("product_id", "quantity", "placed_at")
+    for product_id, quantity, placed_at in orders:
+        scores[product_id] += boost(WEIGHTS["order"] * quantity, placed_at)
+
+    Product.objects.bulk_update(
+        [Product(pk=pk, popularity=score) for pk, score in scores.items()],
+        ["popularity"],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("likes", "0004_like_created_at"),
+        ("shop", "0038_related_product"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="popularity",
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["popularity", "id"], name="product_popularity_id_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_popularity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2 on 2023-04-30 14:25
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan
+
+
+def backfill_stock(apps, schema_editor):
+    Product = apps.get_model("shop", "Product")
+    SizeInventory = apps.get_model("shop", "SizeInventory")
+    ColorInventory = apps.get_model("shop", "ColorInventory")
+
+    def stock(model):
+        return Coalesce(
+            Subquery(
+                model.objects.filter(product=OuterRef("pk"))
+                .order_by()
+                .values("product")
+                .annotate(total=Sum("quantity"))
+                .values("total")
+            ),
+            0,
+        )
+
+    Product.objects.update(variant_stock=stock(SizeInventory) + stock(ColorInventory))
+    total = F("inventory") + F("variant_stock")
+    Product.objects.update(total_available=total, in_stock=GreaterThan(total, 0))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0039_product_popularity"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="in_stock",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="total_available",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="variant_stock",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("in_stock", True)),
+                fields=["title", "id"],
+                name="product_in_stock_title_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("in_stock", True)),
+                fields=["unit_price", "id"],
+                name="product_in_stock_price_idx",
+            ),
+        ),
+        migrations.RunPython(backfill_stock, migrations.RunPython.noop),
+    ]
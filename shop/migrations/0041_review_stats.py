@@ -0,0 +1,69 @@
+# Generated by Django 4.2 on 2023-05-02 10:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_stars(apps, schema_editor):
+    Product = apps.get_model("shop", "Product")
+    Review = apps.get_model("shop", "Review")
+
+    stars = {}
+    for rating in range(1, 6):
+        reviews = (
+            Review.objects.filter(product=OuterRef("pk"), rating=rating)
+            .order_by()
+            .values("product")
+            .annotate(total=Count("id"))
+            .values("total")
+        )
+        stars[f"stars_{rating}"] = Coalesce(Subquery(reviews), 0)
+    Product.objects.update(**stars)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0040_product_stock"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="stars_1",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="stars_2",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="stars_3",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="stars_4",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="stars_5",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["product", "date", "id"], name="review_product_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["product", "rating", "id"], name="review_product_rating_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_stars, migrations.RunPython.noop),
+    ]
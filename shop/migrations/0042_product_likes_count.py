@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2023-05-03 16:40
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_likes_count(apps, schema_editor):
+    Like = apps.get_model("likes", "Like")
+    Product = apps.get_model("shop", "Product")
+
+    likes = (
+        Like.objects.filter(
+            content_type__app_label="shop",
+            content_type__model="product",
+            object_id=OuterRef("pk"),
+        )
+        .order_by()
+        .values("object_id")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    Product.objects.update(likes_count=Coalesce(Subquery(likes), 0))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("likes", "0004_like_created_at"),
+        ("shop", "0041_review_stats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="likes_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_likes_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2023-05-04 11:25
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recount_likes(apps, schema_editor):
+    # Duplicate likes were deleted by likes.0005_like_unique
+    Like = apps.get_model("likes", "Like")
+    Product = apps.get_model("shop", "Product")
+
+    likes = (
+        Like.objects.filter(
+            content_type__app_label="shop",
+            content_type__model="product",
+            object_id=OuterRef("pk"),
+        )
+        .order_by()
+        .values("object_id")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    Product.objects.update(likes_count=Coalesce(Subquery(likes), 0))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("likes", "0005_like_unique"),
+        ("shop", "0042_product_likes_count"),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_likes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2 on 2023-05-05 09:30
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum, Value
+from django.db.models.functions import Coalesce
+import django.db.models.functions.comparison
+
+
+def merge_duplicate_items(apps, schema_editor):
+    CartItem = apps.get_model("shop", "CartItem")
+
+    duplicates = (
+        CartItem.objects.annotate(
+            size_key=Coalesce("size", Value("")),
+            color_key=Coalesce("color", Value("")),
+        )
+        .values("cart", "product", "size_key", "color_key")
+        .annotate(first=Min("id"), quantity=Sum("quantity"), total=Count("id"))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    for duplicate in duplicates:
+        items = CartItem.objects.annotate(
+            size_key=Coalesce("size", Value("")),
+            color_key=Coalesce("color", Value("")),
+        ).filter(
+            cart=duplicate["cart"],
+            product=duplicate["product"],
+            size_key=duplicate["size_key"],
+            color_key=duplicate["color_key"],
+        )
+        items.exclude(pk=duplicate["first"]).delete()
+        CartItem.objects.filter(pk=duplicate["first"]).update(
+            quantity=duplicate["quantity"]
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0043_recount_product_likes"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="cartitem",
+            constraint=models.UniqueConstraint(
+                models.F("cart"),
+                models.F("product"),
+                django.db.models.functions.comparison.Coalesce(
+                    "size", models.Value("")
+                ),
+                django.db.models.functions.comparison.Coalesce(
+                    "color", models.Value("")
+                ),
+                name="cart_item_unique",
+            ),
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 4.2 on 2023-05-06 10:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0044_cart_item_unique"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="product",
+            name="product_inventory_idx",
+        ),
+    ]
@@ -3,12 +3,27 @@ from uuid import uuid4
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericRelation
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models import Q, Sum
+from django.db import models, transaction
+from django.db.models import (
+    Avg,
+    Count,
+    F,
+    FloatField,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
 
 from likes.models import Like
 from shop.validators import validate_file_size
 
+RATINGS = range(1, 6)
+
 
 class Color(models.Model):
     name = models.CharField(max_length=200, null=True, blank=True, unique=True)
@@ -30,11 +45,34 @@ class Size(models.Model):
         return self.size
 
 
+class CollectionQuerySet(models.QuerySet):
+    def rebuild_products_count(self):
+        """
+        Recompute the stored product count of these collections, touching
+        their `last_update` as the count is part of their payload.
+        """
+        products = (
+            Product.objects.filter(collection=OuterRef("pk"))
+            .order_by()
+            .values("collection")
+            .annotate(total=Count("id"))
+            .values("total")
+        )
+        return self.update(
+            products_count=Coalesce(Subquery(products), 0), last_update=timezone.now()
+        )
+
+
 class Collection(models.Model):
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         "Product", on_delete=models.SET_NULL, null=True, related_name="+", blank=True
     )
+    last_update = models.DateTimeField(auto_now=True)
+    # Kept in sync by the Product signal handlers, see shop.signals.handlers
+    products_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CollectionQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.title
@@ -43,7 +81,88 @@ class Collection(models.Model):
         ordering = ["title"]
 
 
-class Product(models.Model):
+class ProductQuerySet(models.QuerySet):
+    def rebuild_stock(self):
+        """
+        Recompute the stored `variant_stock`, `total_available` and `in_stock`
+        of these products from their inventory, size and color quantities.
+        """
+        size_stock = (
+            SizeInventory.objects.filter(product=OuterRef("pk"))
+            .order_by()
+            .values("product")
+            .annotate(total=Sum("quantity"))
+            .values("total")
+        )
+        color_stock = (
+            ColorInventory.objects.filter(product=OuterRef("pk"))
+            .order_by()
+            .values("product")
+            .annotate(total=Sum("quantity"))
+            .values("total")
+        )
+        with transaction.atomic():
+            self.update(
+                variant_stock=Coalesce(Subquery(size_stock), 0)
+                + Coalesce(Subquery(color_stock), 0)
+            )
+            # Reads the variant stock written above
+            total = F("inventory") + F("variant_stock")
+            return self.update(total_available=total, in_stock=GreaterThan(total, 0))
+
+    def rebuild_rating_stats(self):
+        """Recompute the stored review stats of these products from their reviews."""
+        reviews = (
+            Review.objects.filter(product=OuterRef("pk"))
+            .order_by()
+            .values("product")
+        )
+        stars = {
+            f"stars_{rating}": Coalesce(
+                Subquery(
+                    reviews.filter(rating=rating)
+                    .annotate(total=Count("id"))
+                    .values("total")
+                ),
+                0,
+            )
+            for rating in RATINGS
+        }
+        return self.update(
+            **stars,
+            review_count=Coalesce(
+                Subquery(reviews.annotate(total=Count("id")).values("total")), 0
+            ),
+            rating_sum=Coalesce(
+                Subquery(reviews.annotate(total=Sum("rating")).values("total")), 0
+            ),
+            average_rating=Coalesce(
+                Subquery(
+                    reviews.annotate(
+                        average=Avg("rating", output_field=FloatField())
+                    ).values("average")
+                ),
+                0.0,
+            ),
+        )
+
+
+class StockSourceMixin:
+    """
+    Saves and deletes in one transaction with the update of the product stock
+    made by the post_save / post_delete signal handlers.
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+
+class Product(StockSourceMixin, models.Model):
     title = models.CharField(max_length=255)
     description = models.TextField(null=True, blank=True)
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
@@ -56,33 +175,98 @@ class Product(models.Model):
     likes = GenericRelation(Like)
     is_digital = models.BooleanField(default=False)
     url = models.URLField(max_length=500, null=True, blank=True)
+    # Kept in sync by the Review signal handlers, see shop.signals.handlers
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    average_rating = models.FloatField(default=0.0, editable=False)
+    # Number of reviews rating the product 1 to 5 stars
+    stars_1 = models.PositiveIntegerField(default=0, editable=False)
+    stars_2 = models.PositiveIntegerField(default=0, editable=False)
+    stars_3 = models.PositiveIntegerField(default=0, editable=False)
+    stars_4 = models.PositiveIntegerField(default=0, editable=False)
+    stars_5 = models.PositiveIntegerField(default=0, editable=False)
+    # Kept in sync by the Like signal handlers, see shop.signals.handlers
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    # Forward decayed score of likes, reviews and orders, see shop.popularity
+    popularity = models.FloatField(default=0.0, editable=False)
+    # Kept in sync with the inventories by the signal handlers, see
+    # ProductQuerySet.rebuild_stock()
+    variant_stock = models.IntegerField(default=0, editable=False)
+    total_available = models.IntegerField(default=0, editable=False)
+    in_stock = models.BooleanField(default=False, editable=False)
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.title
 
     @property
     def rating(self):
-        total_reviews = self.reviews.count()
-        sum_of_ratings = sum([item.ratings for item in self.reviews.all()])
-
-        try:
-            rating = float(sum_of_ratings / total_reviews)
-        except ZeroDivisionError:
-            rating = 1.0
-
-        return rating
+        if self.review_count < 1:
+            return 1.0
+        return self.average_rating
 
     @property
     def total_review(self):
-        total = self.reviews.count()
-        if total < 1:
+        if self.review_count < 1:
             return 1
-        return total
+        return self.review_count
 
-    # d
+    @property
+    def rating_histogram(self):
+        return {rating: getattr(self, f"stars_{rating}") for rating in RATINGS}
 
     class Meta:
         ordering = ["title"]
+        # Keyset pagination orderings, see ProductViewSet.keyset_orderings
+        indexes = [
+            models.Index(fields=["title", "id"], name="product_title_id_idx"),
+            models.Index(fields=["last_update", "id"], name="product_updated_id_idx"),
+            models.Index(fields=["unit_price", "id"], name="product_price_id_idx"),
+            # ProductFilter
+            models.Index(
+                fields=["collection", "unit_price"], name="product_collection_price_idx"
+            ),
+            models.Index(
+                fields=["is_digital", "unit_price"], name="product_digital_price_idx"
+            ),
+            models.Index(fields=["popularity", "id"], name="product_popularity_id_idx"),
+            # In-stock listings, in the default and price orderings
+            models.Index(
+                fields=["title", "id"],
+                condition=Q(in_stock=True),
+                name="product_in_stock_title_idx",
+            ),
+            models.Index(
+                fields=["unit_price", "id"],
+                condition=Q(in_stock=True),
+                name="product_in_stock_price_idx",
+            ),
+        ]
+
+
+class RelatedProduct(models.Model):
+    """
+    A "customers also bought" neighbor of a product, rebuilt in bulk from the
+    orders by `shop.recommendations.build_related_products()`.
+    """
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="related_products"
+    )
+    related = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="related_to"
+    )
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ["product", "rank"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "rank"], name="related_product_rank_unique"
+            )
+        ]
 
 
 class ProductImage(models.Model):
@@ -92,7 +276,7 @@ class ProductImage(models.Model):
     image = models.ImageField(upload_to="store/images", validators=[validate_file_size])
 
 
-class SizeInventory(models.Model):
+class SizeInventory(StockSourceMixin, models.Model):
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name="size_inventory"
     )
@@ -106,12 +290,15 @@ class SizeInventory(models.Model):
 
     class Meta:
         verbose_name_plural = "Product Size & Inventories"
+        indexes = [
+            models.Index(fields=["size", "product"], name="size_inventory_product_idx")
+        ]
 
     def __str__(self):
         return self.product.title
 
 
-class ColorInventory(models.Model):
+class ColorInventory(StockSourceMixin, models.Model):
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name="color_inventory"
     )
@@ -125,6 +312,11 @@ class ColorInventory(models.Model):
 
     class Meta:
         verbose_name_plural = "Product Color & Inventories"
+        indexes = [
+            models.Index(
+                fields=["color", "product"], name="color_inventory_product_idx"
+            )
+        ]
 
     def __str__(self):
         return self.product.title
@@ -157,6 +349,12 @@ class Order(models.Model):
 
     class Meta:
         permissions = [("cancel_order", "Can cancel order")]
+        indexes = [
+            models.Index(fields=["placed_at", "id"], name="order_placed_id_idx"),
+            models.Index(
+                fields=["customer", "placed_at", "id"], name="order_customer_placed_idx"
+            ),
+        ]
 
 
 class TrackOrder(models.Model):
@@ -184,6 +382,8 @@ class BillingAddress(models.Model):
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Touched by the CartItem signal handlers
+    last_update = models.DateTimeField(auto_now=True)
 
 
 class CartItem(models.Model):
@@ -194,21 +394,25 @@ class CartItem(models.Model):
     color = models.CharField(max_length=100, null=True, blank=True)
     hex_code = models.CharField(max_length=100, null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            # A missing size or color is NULL, which never conflicts. Also the
+            # conflict target of shop.cart_items.add_item()
+            models.UniqueConstraint(
+                F("cart"),
+                F("product"),
+                Coalesce("size", Value("")),
+                Coalesce("color", Value("")),
+                name="cart_item_unique",
+            )
+        ]
+
     @property
     def resolved_price(self):
-        main_price = self.product.unit_price
-
-        colors_price = self.product.color_inventory.filter(
-            ~Q(extra_price=None), color__name=self.color
-        ).aggregate(c_total=Sum("extra_price"))["c_total"]
-
-        sizes_price = self.product.size_inventory.filter(
-            ~Q(extra_price=None), size__size=self.size
-        ).aggregate(s_total=Sum("extra_price"))["s_total"]
-
-        prices = [main_price, sizes_price, colors_price]
+        """Line total, price several items at once with shop.pricing.CartPricing."""
+        from shop.pricing import CartPricing
 
-        return self.quantity * sum([price for price in prices if price is not None])
+        return CartPricing.for_items([self]).item_total(self)
 
 
 class Review(models.Model):
@@ -221,6 +425,27 @@ class Review(models.Model):
     description = models.TextField()
     date = models.DateField(auto_now_add=True)
 
+    def save(self, *args, **kwargs):
+        # The rating stats of the product are updated by a post_save handler,
+        # keep both writes in the same transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+    class Meta:
+        # Keyset pagination orderings, see ReviewViewSet.keyset_orderings
+        indexes = [
+            models.Index(
+                fields=["product", "date", "id"], name="review_product_date_idx"
+            ),
+            models.Index(
+                fields=["product", "rating", "id"], name="review_product_rating_idx"
+            ),
+        ]
+
 
 class Notification(models.Model):
     NOTIFICATION_TYPE_CHOICES = (
@@ -237,5 +462,12 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["created_at", "id"], name="notification_created_id_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"Type: {self.type}----Title: {self.title}"
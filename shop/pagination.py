@@ -1,4 +1,188 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
 
 class DefaultPagination(PageNumberPagination):
-  page_size = 10
\ No newline at end of file
+  page_size = 10
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks past the last row of the previous page with a
+    `WHERE (title, id) > (last title, last id)` style condition instead of an
+    OFFSET, so every page costs the same. The ordering must end with a unique
+    field and should be backed by an index.
+
+    The view lists its supported orderings in `keyset_orderings`, keyed by the
+    value of the `ordering` query parameter, the first one being the default.
+    Pass `count=false` to skip the total count query, or `count=true` to run it
+    when the view doesn't count by default.
+    """
+
+    page_size = 10
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    ordering_query_param = "ordering"
+    count_query_param = "count"
+
+    def __init__(self, orderings, count=True):
+        self.orderings = orderings
+        self.count_by_default = count
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering_name, self.ordering = self.get_ordering(request)
+        self.page_size = self.get_page_size(request)
+        self.fields = [
+            queryset.model._meta.get_field(name.lstrip("-")) for name in self.ordering
+        ]
+
+        self.count = None
+        if self.should_count(request):
+            self.count = queryset.count()
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.seek_condition(position))
+
+        rows = list(queryset.order_by(*self.ordering)[: self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+
+        self.next_position = None
+        if self.has_next:
+            last = rows[-1]
+            # Model instances or values() rows
+            if isinstance(last, dict):
+                self.next_position = [last[field.attname] for field in self.fields]
+            else:
+                self.next_position = [
+                    getattr(last, field.attname) for field in self.fields
+                ]
+        return rows
+
+    def get_ordering(self, request):
+        name = request.query_params.get(self.ordering_query_param)
+        if name is None:
+            name = next(iter(self.orderings))
+        if name not in self.orderings:
+            raise ValidationError(
+                {
+                    "message": f"Cursor pagination supports ordering by "
+                    f"{', '.join(self.orderings)} only",
+                    "status": False,
+                }
+            )
+        return name, self.orderings[name]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def should_count(self, request):
+        value = request.query_params.get(self.count_query_param)
+        if value is None:
+            return self.count_by_default
+        return value.lower() not in ("0", "false", "no")
+
+    def seek_condition(self, position):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition = Q()
+        for index, name in enumerate(self.ordering):
+            lookup = "lt" if name.startswith("-") else "gt"
+            step = Q(**{f"{name.lstrip('-')}__{lookup}": position[index]})
+            for previous, value in zip(self.ordering[:index], position):
+                step &= Q(**{previous.lstrip("-"): value})
+            condition |= step
+        return condition
+
+    def encode_cursor(self, position):
+        # Unlike DjangoJSONEncoder, keep the microseconds of datetimes: a
+        # truncated position would repeat rows of the previous page
+        values = [
+            value.isoformat() if hasattr(value, "isoformat") else value
+            for value in position
+        ]
+        payload = json.dumps([self.ordering_name, values], default=str)
+        return urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+
+        try:
+            padding = "=" * (-len(cursor) % 4)
+            ordering_name, values = json.loads(urlsafe_b64decode(cursor + padding))
+            if ordering_name != self.ordering_name or len(values) != len(
+                self.fields
+            ):
+                raise ValueError
+            return [
+                field.to_python(value) for field, value in zip(self.fields, values)
+            ]
+        except (TypeError, ValueError, DjangoValidationError):
+            raise NotFound({"message": "Invalid cursor", "status": False})
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.next_position)
+        )
+
+    def get_page_info(self):
+        info = {"next": self.get_next_link()}
+        if self.count is not None:
+            info["count"] = self.count
+        return info
+
+    def get_paginated_response(self, data):
+        return Response({**self.get_page_info(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "count": {"type": "integer", "example": 123},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class KeysetPaginationMixin:
+    """
+    Switches a view to `KeysetPagination` when the request carries a `cursor`
+    query parameter, an empty one asks for the first page. Other requests keep
+    the view's `pagination_class`, unless `keyset_only` is set.
+    """
+
+    keyset_orderings = {}
+    keyset_only = False
+    keyset_count = True
+
+    @property
+    def paginator(self):
+        if (
+            not self.keyset_only
+            and KeysetPagination.cursor_query_param not in self.request.query_params
+        ):
+            return super().paginator
+        if not hasattr(self, "_keyset_paginator"):
+            self._keyset_paginator = KeysetPagination(
+                self.keyset_orderings, count=self.keyset_count
+            )
+        return self._keyset_paginator
@@ -0,0 +1,97 @@
+"""
+Time decayed popularity of the products.
+
+The popularity of a product is the sum of the weights of its likes, reviews
+and orders, each decayed with its age: w * exp(-λ (now - t)). Stored as is,
+every score would have to be recomputed as time passes, so
+`Product.popularity` holds the forward decayed sum
+
+    Σ w * exp(λ (t - LANDMARK))
+
+instead. An event only adds (or removes) its own term with an F() update, and
+as the decayed score of every product is its stored value times the same
+exp(-λ (now - LANDMARK)), ordering by the stored column is ordering by the
+decayed score, straight from an index.
+
+The terms grow by a factor 2 every half-life and a float overflows after
+~1000 of them, i.e. ~19 years with the default 7 days half-life. Changing
+`LANDMARK` or `POPULARITY_HALF_LIFE` requires the `rebuild_popularity`
+command.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from likes.models import Like
+from shop.models import Order, Product, Review
+
+LANDMARK = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+
+WEIGHTS = {"like": 1.0, "review": 2.0, "order": 3.0}
+
+
+def decay_rate():
+    half_life = getattr(settings, "POPULARITY_HALF_LIFE", timedelta(days=7))
+    return math.log(2) / half_life.total_seconds()
+
+
+def review_time(review):
+    # Reviews only store their date
+    return datetime.combine(review.date, time.min, tzinfo=dt_timezone.utc)
+
+
+def boost(weight, at):
+    """The forward decayed term of an event of `weight` happening `at`."""
+    return weight * math.exp(decay_rate() * (at - LANDMARK).total_seconds())
+
+
+def record(product_id, event, at=None, count=1, **updates):
+    """
+    Add `count` `event`s ("like", "review" or "order") that happened `at` to
+    the popularity of a product, a negative count removes them. `updates` of
+    other fields are applied by the same UPDATE.
+    """
+    amount = boost(WEIGHTS[event] * count, at or timezone.now())
+    Product.objects.filter(pk=product_id).update(
+        popularity=Greatest(F("popularity") + amount, 0.0), **updates
+    )
+
+
+def current_score(popularity, now=None):
+    """The decayed score of a stored `Product.popularity` as of `now`."""
+    now = now or timezone.now()
+    return popularity * math.exp(-decay_rate() * (now - LANDMARK).total_seconds())
+
+
+def rebuild_popularity(batch_size=1000):
+    """Recompute the popularity of every product from its events."""
+    scores = defaultdict(float)
+
+    content_type = ContentType.objects.get_for_model(Product)
+    likes = Like.objects.filter(content_type=content_type)
+    for product_id, created_at in likes.values_list("object_id", "created_at"):
+        scores[product_id] += boost(WEIGHTS["like"], created_at)
+
+    for review in Review.objects.only("product_id", "date").iterator():
+        scores[review.product_id] += boost(WEIGHTS["review"], review_time(review))
+
+    orders = Order.objects.values_list("product_id", "quantity", "placed_at")
+    for product_id, quantity, placed_at in orders.iterator():
+        scores[product_id] += boost(WEIGHTS["order"] * quantity, placed_at)
+
+    products = [
+        Product(pk=product_id, popularity=score)
+        for product_id, score in scores.items()
+    ]
+    with transaction.atomic():
+        Product.objects.update(popularity=0.0)
+        Product.objects.bulk_update(products, ["popularity"], batch_size=batch_size)
+    return len(products)
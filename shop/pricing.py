@@ -0,0 +1,80 @@
+"""
+Cart pricing.
+
+A cart line costs quantity * (unit price + extra price of its size + extra
+price of its color). Rather than two aggregate queries per line, the extra
+prices of every product of a cart are loaded at once, sizes and colors in a
+single UNION query, and the line and cart totals are computed in memory.
+
+`CartSerializer`, `CartItemSerializer`, `CreateOrderSerializer` and the fast
+path of `shop.fast_serializers` all price carts with `CartPricing`.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import CharField, F, Value
+
+from shop.models import ColorInventory, SizeInventory
+
+
+def extra_prices(product_ids):
+    """
+    Summed extra prices of the products keyed by ("size", product id, size)
+    and ("color", product id, color), in one query.
+    """
+    sizes = SizeInventory.objects.filter(
+        product_id__in=product_ids, extra_price__isnull=False
+    ).values_list(
+        Value("size", output_field=CharField()),
+        "product_id",
+        F("size__size"),
+        "extra_price",
+    )
+    colors = ColorInventory.objects.filter(
+        product_id__in=product_ids, extra_price__isnull=False
+    ).values_list(
+        Value("color", output_field=CharField()),
+        "product_id",
+        F("color__name"),
+        "extra_price",
+    )
+
+    prices = defaultdict(Decimal)
+    for kind, product_id, name, extra_price in sizes.union(colors, all=True):
+        prices[kind, product_id, name] += extra_price
+    return dict(prices)
+
+
+class CartPricing:
+    """Prices of the lines of carts holding the given products."""
+
+    def __init__(self, product_ids):
+        product_ids = set(product_ids)
+        self.extra_prices = extra_prices(product_ids) if product_ids else {}
+
+    @classmethod
+    def for_items(cls, items):
+        return cls(item.product_id for item in items)
+
+    def unit_price(self, product_id, unit_price, size=None, color=None):
+        return (
+            unit_price
+            + self.extra_prices.get(("size", product_id, size), 0)
+            + self.extra_prices.get(("color", product_id, color), 0)
+        )
+
+    def line_total(self, product_id, unit_price, quantity, size=None, color=None):
+        return quantity * self.unit_price(product_id, unit_price, size, color)
+
+    def item_total(self, item):
+        """Line total of a `CartItem` with its product loaded."""
+        return self.line_total(
+            item.product_id,
+            item.product.unit_price,
+            item.quantity,
+            item.size,
+            item.color,
+        )
+
+    def total(self, items):
+        return sum(self.item_total(item) for item in items)
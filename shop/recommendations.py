@@ -0,0 +1,116 @@
+"""
+"Customers also bought" recommendations computed offline from the orders.
+
+An order row holds a single product, so the orders a customer placed within
+`window` of each other make one basket. Baskets become the rows of a sparse
+binary basket x product matrix B, and B.T @ B counts for every pair of
+products the baskets holding both, in one sparse product whose cost grows
+with the number of orders rather than with the square of the catalog. The
+counts are normalized by the popularity of both products (cosine
+similarity), so best sellers don't become everyone's neighbor, and the top
+`top_k` neighbors of each product are stored in `RelatedProduct` where
+serving them is a single indexed read.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db import transaction
+from scipy import sparse
+
+from shop.models import Order, RelatedProduct
+
+DEFAULT_WINDOW = timedelta(hours=24)
+DEFAULT_TOP_K = 10
+
+
+def order_baskets(window=DEFAULT_WINDOW):
+    """
+    (basket index, product id) arrays of the orders, a basket being the
+    orders a customer placed less than `window` after their previous one.
+    """
+    rows = (
+        Order.objects.exclude(payment_status=Order.PAYMENT_STATUS_FAILED)
+        .order_by("customer_id", "placed_at")
+        .values_list("customer_id", "placed_at", "product_id")
+    )
+    # Customer ids may be UUIDs, only where they change matters
+    new_customer, timestamps, products = [], [], []
+    previous = None
+    for customer_id, placed_at, product_id in rows.iterator(chunk_size=5000):
+        new_customer.append(customer_id != previous)
+        timestamps.append(placed_at.timestamp())
+        products.append(product_id)
+        previous = customer_id
+
+    products = np.array(products, dtype=np.int64)
+    if not len(products):
+        return products, products
+
+    gaps = np.diff(np.array(timestamps, dtype=np.float64), prepend=-np.inf)
+    starts = np.array(new_customer, dtype=bool) | (gaps > window.total_seconds())
+    return np.cumsum(starts) - 1, products
+
+
+def co_purchase_neighbors(baskets, products, top_k=DEFAULT_TOP_K, min_count=1):
+    """
+    {product id: [(neighbor id, score), ...]} of the `top_k` products most
+    often bought with each product, best first.
+    """
+    if not len(products):
+        return {}
+
+    product_ids, columns = np.unique(products, return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(columns), dtype=np.float32), (baskets, columns)),
+        shape=(baskets[-1] + 1, len(product_ids)),
+    )
+    # A product ordered twice in a basket still counts once
+    matrix.data[:] = 1
+
+    counts = (matrix.T @ matrix).tocsr()
+    purchases = counts.diagonal()
+    counts.setdiag(0)
+    counts.data[counts.data < min_count] = 0
+    counts.eliminate_zeros()
+
+    # cosine(i, j) = count(i, j) / sqrt(baskets(i) * baskets(j))
+    norms = sparse.diags(1 / np.sqrt(purchases))
+    scores = (norms @ counts @ norms).tocsr()
+
+    neighbors = {}
+    for row in range(scores.shape[0]):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        if start == end:
+            continue
+        row_scores = scores.data[start:end]
+        row_columns = scores.indices[start:end]
+        if end - start > top_k:
+            best = np.argpartition(-row_scores, top_k)[:top_k]
+            row_scores, row_columns = row_scores[best], row_columns[best]
+        # Ties are broken by product id so rebuilds are stable
+        order = np.lexsort((product_ids[row_columns], -row_scores))
+        neighbors[int(product_ids[row])] = [
+            (int(product_ids[row_columns[index]]), float(row_scores[index]))
+            for index in order
+        ]
+    return neighbors
+
+
+def build_related_products(window=DEFAULT_WINDOW, top_k=DEFAULT_TOP_K, min_count=1):
+    """Recompute every `RelatedProduct` row, return the number of products."""
+    baskets, products = order_baskets(window)
+    neighbors = co_purchase_neighbors(baskets, products, top_k, min_count)
+
+    with transaction.atomic():
+        RelatedProduct.objects.all().delete()
+        RelatedProduct.objects.bulk_create(
+            [
+                RelatedProduct(
+                    product_id=product_id, related_id=related_id, rank=rank, score=score
+                )
+                for product_id, related in neighbors.items()
+                for rank, (related_id, score) in enumerate(related, start=1)
+            ],
+            batch_size=5000,
+        )
+    return len(neighbors)
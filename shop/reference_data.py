@@ -0,0 +1,74 @@
+"""
+In-process cache of the Color and Size reference tables.
+
+Both tables are tiny and almost never written, yet carts look their rows up
+by name for every item. Each worker loads a whole table into a name -> row
+map on first use and serves the lookups from memory.
+
+Saving or deleting a row (see shop.signals.handlers) drops the map of the
+worker and bumps a version in the cache, once right away and once more when
+the transaction commits, so a worker reloading in between doesn't keep the
+table as it was before the commit. The other workers compare their version
+with the cached one at most every `VERSION_CHECK_INTERVAL` seconds. Bulk
+writes skip the signals and call `invalidate()` themselves.
+
+The rows are shared by every request of the worker and must not be modified.
+"""
+import threading
+import time
+
+from shop import cache as catalog_cache
+from shop.models import Color, Size
+
+VERSION_CHECK_INTERVAL = 5
+
+
+class ReferenceCache:
+    def __init__(self, model, key_field):
+        self.model = model
+        self.key_field = key_field
+        self.version_key = f"reference:{model._meta.label_lower}:version"
+        self.lock = threading.Lock()
+        self.rows = None
+        self.version = None
+        self.version_checked_at = 0
+
+    def load(self):
+        with self.lock:
+            (version,) = catalog_cache.get_versions([self.version_key])
+            self.rows = {
+                getattr(row, self.key_field): row for row in self.model.objects.all()
+            }
+            self.version = version
+            self.version_checked_at = time.monotonic()
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+        if self.rows is None:
+            self.load()
+        elif now - self.version_checked_at > VERSION_CHECK_INTERVAL:
+            self.version_checked_at = now
+            (version,) = catalog_cache.get_versions([self.version_key])
+            if version != self.version:
+                self.load()
+
+    def get(self, name):
+        """The row named `name`, or None."""
+        if not name:
+            return None
+        self.ensure_fresh()
+        return self.rows.get(name)
+
+    def clear(self):
+        """Reload this worker's map on next use."""
+        self.rows = None
+
+    def invalidate(self):
+        """Reload the map of every worker on next use, after a write."""
+        self.clear()
+        # Bumped again on commit
+        catalog_cache.bump([self.version_key])
+
+
+colors = ReferenceCache(Color, "name")
+sizes = ReferenceCache(Size, "size")
@@ -0,0 +1,299 @@
+"""
+Full-text product search.
+
+Every product has a search document made of its title, collection title and
+description. On SQLite the documents live in the `shop_product_fts` FTS5 table
+(the rowid is the product id), on PostgreSQL in `shop_product_search` with a
+weighted `tsvector` column behind a GIN index. Both tables are created by the
+0033_product_search migration and kept up to date by the product and
+collection signal handlers.
+
+The highlighted titles and snippets are HTML: the catalog text is escaped and
+the matches wrapped in <mark> tags. The database marks the matches with
+private use characters, so the tags are only added after escaping.
+"""
+import re
+from collections import namedtuple
+
+from django.db import connection as default_connection
+from django.utils.html import escape
+
+SearchHit = namedtuple("SearchHit", ["product_id", "rank", "title", "snippet"])
+
+HIGHLIGHT_START = "\ue000"
+HIGHLIGHT_STOP = "\ue001"
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query or "")[:10]
+
+
+def highlight(text):
+    """Escape `text` and turn its match markers into <mark> tags."""
+    return (
+        escape(text or "")
+        .replace(HIGHLIGHT_START, "<mark>")
+        .replace(HIGHLIGHT_STOP, "</mark>")
+    )
+
+
+def document_rows(product_ids):
+    """(id, title, description, collection title) of the given products."""
+    from shop.models import Product
+
+    return list(
+        Product.objects.filter(pk__in=product_ids)
+        .order_by()
+        .values_list("id", "title", "description", "collection__title")
+    )
+
+
+class SQLiteSearchBackend:
+    table = "shop_product_fts"
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def match_expression(self, tokens):
+        # Every term is quoted so user input can never be read as FTS5 syntax,
+        # the last one is matched as a prefix for search-as-you-type
+        terms = ['"%s"' % token for token in tokens]
+        terms[-1] += "*"
+        return " ".join(terms)
+
+    def index(self, product_ids):
+        rows = document_rows(product_ids)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN (%s)"
+                % ", ".join(["%s"] * len(product_ids)),
+                list(product_ids),
+            )
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, title, description, collection) "
+                "VALUES (%s, %s, %s, %s)",
+                [
+                    (pk, title, description or "", collection or "")
+                    for pk, title, description, collection in rows
+                ],
+            )
+
+    def remove(self, product_ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN (%s)"
+                % ", ".join(["%s"] * len(product_ids)),
+                list(product_ids),
+            )
+
+    def count(self, tokens):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) FROM {self.table} WHERE {self.table} MATCH %s",
+                [self.match_expression(tokens)],
+            )
+            return cursor.fetchone()[0]
+
+    def search(self, tokens, offset, limit):
+        # bm25() is lower-is-better, weights follow the column order:
+        # title, description, collection
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, bm25({self.table}, 10.0, 1.0, 4.0) AS rank, "
+                f"highlight({self.table}, 0, %s, %s), "
+                f"snippet({self.table}, 1, %s, %s, '…', 24) "
+                f"FROM {self.table} WHERE {self.table} MATCH %s "
+                "ORDER BY rank, rowid LIMIT %s OFFSET %s",
+                [
+                    HIGHLIGHT_START,
+                    HIGHLIGHT_STOP,
+                    HIGHLIGHT_START,
+                    HIGHLIGHT_STOP,
+                    self.match_expression(tokens),
+                    limit,
+                    offset,
+                ],
+            )
+            return [
+                SearchHit(pk, -rank, highlight(title), highlight(snippet))
+                for pk, rank, title, snippet in cursor.fetchall()
+            ]
+
+
+class PostgresSearchBackend:
+    table = "shop_product_search"
+    # No stemming so that the last term can be matched as a prefix
+    config = "simple"
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def tsquery(self, tokens):
+        terms = list(tokens)
+        terms[-1] += ":*"
+        return " & ".join(terms)
+
+    def index(self, product_ids):
+        rows = document_rows(product_ids)
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.table} (product_id, title, description, document) "
+                "VALUES (%s, %s, %s, "
+                "setweight(to_tsvector(%s, %s), 'A') || "
+                "setweight(to_tsvector(%s, %s), 'B') || "
+                "setweight(to_tsvector(%s, %s), 'C')) "
+                "ON CONFLICT (product_id) DO UPDATE SET title = EXCLUDED.title, "
+                "description = EXCLUDED.description, document = EXCLUDED.document",
+                [
+                    (
+                        pk,
+                        title,
+                        description or "",
+                        self.config,
+                        title,
+                        self.config,
+                        collection or "",
+                        self.config,
+                        description or "",
+                    )
+                    for pk, title, description, collection in rows
+                ],
+            )
+
+    def remove(self, product_ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE product_id = ANY(%s)",
+                [list(product_ids)],
+            )
+
+    def count(self, tokens):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) FROM {self.table} "
+                "WHERE document @@ to_tsquery(%s, %s)",
+                [self.config, self.tsquery(tokens)],
+            )
+            return cursor.fetchone()[0]
+
+    def search(self, tokens, offset, limit):
+        # Headlines are expensive, only build them for the rows of the page
+        options = (
+            f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, "
+            "MaxWords=24, MinWords=8"
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT hits.product_id, hits.rank, "
+                "ts_headline(%s, hits.title, hits.query, %s), "
+                "ts_headline(%s, hits.description, hits.query, %s) "
+                "FROM ("
+                "  SELECT product_id, title, description, query, "
+                "  ts_rank_cd(document, query) AS rank "
+                f"  FROM {self.table}, to_tsquery(%s, %s) AS query "
+                "  WHERE document @@ query "
+                "  ORDER BY rank DESC, product_id LIMIT %s OFFSET %s"
+                ") AS hits ORDER BY hits.rank DESC, hits.product_id",
+                [
+                    self.config,
+                    options + ", HighlightAll=true",
+                    self.config,
+                    options,
+                    self.config,
+                    self.tsquery(tokens),
+                    limit,
+                    offset,
+                ],
+            )
+            return [
+                SearchHit(pk, rank, highlight(title), highlight(snippet))
+                for pk, rank, title, snippet in cursor.fetchall()
+            ]
+
+
+class FallbackSearchBackend:
+    """Unranked `icontains` search for databases without a full-text index."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def index(self, product_ids):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def queryset(self, tokens):
+        from django.db.models import Q
+
+        from shop.models import Product
+
+        condition = Q()
+        for token in tokens:
+            condition &= (
+                Q(title__icontains=token)
+                | Q(description__icontains=token)
+                | Q(collection__title__icontains=token)
+            )
+        return Product.objects.filter(condition).order_by("title", "id")
+
+    def count(self, tokens):
+        return self.queryset(tokens).count()
+
+    def search(self, tokens, offset, limit):
+        rows = self.queryset(tokens).values_list("id", "title", "description")
+        return [
+            SearchHit(pk, 0.0, highlight(title), highlight(description))
+            for pk, title, description in rows[offset : offset + limit]
+        ]
+
+
+BACKENDS = {
+    "sqlite": SQLiteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+def get_backend(connection=None):
+    connection = connection or default_connection
+    return BACKENDS.get(connection.vendor, FallbackSearchBackend)(connection)
+
+
+def index_products(product_ids):
+    if product_ids:
+        get_backend().index(list(product_ids))
+
+
+def remove_products(product_ids):
+    if product_ids:
+        get_backend().remove(list(product_ids))
+
+
+class SearchResults:
+    """
+    Lazy, sliceable result set of a search so it can be handed to a Django
+    paginator: `len()` runs the count query and slicing runs the ranked query
+    for that page only.
+    """
+
+    def __init__(self, query, backend=None):
+        self.tokens = tokenize(query)
+        self.backend = backend or get_backend()
+
+    def count(self):
+        if not self.tokens:
+            return 0
+        return self.backend.count(self.tokens)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key : key + 1][0]
+        if not self.tokens:
+            return []
+        offset = key.start or 0
+        return self.backend.search(self.tokens, offset, key.stop - offset)
@@ -1,9 +1,13 @@
 from django.contrib.auth import get_user_model
-from django.db import transaction
+from django.db import models, transaction
+from django.utils import timezone
 from rest_framework import serializers
 
 from likes.models import Like
 from likes.serializers import LikeSerializer
+from shop import reference_data
+from shop.cart_items import add_item, add_items, validate_items
+from shop.pricing import CartPricing
 from shop.signals import order_created
 from utils.views import id_generator
 from .models import (
@@ -68,12 +72,27 @@ class ColorInventorySerializer(serializers.ModelSerializer):
         fields = ["quantity", "extra_price", "color"]
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class DynamicFieldsMixin:
+    """Takes an optional `fields` argument naming the only fields to render."""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     sizes = SizeInventorySerializer(source="size_inventory", many=True, read_only=True)
     colors = ColorInventorySerializer(
         source="color_inventory", many=True, read_only=True
     )
     images = ProductImageSerializer(many=True, read_only=True)
+    # Not stored, rendered False and set for the current user by
+    # ProductViewSet.mark_liked(), the only source of the flag
+    is_liked = serializers.BooleanField(read_only=True, default=False)
 
     class Meta:
         model = Product
@@ -87,6 +106,11 @@ class ProductSerializer(serializers.ModelSerializer):
             "collection",
             "rating",
             "total_review",
+            "variant_stock",
+            "total_available",
+            "in_stock",
+            "likes_count",
+            "is_liked",
             "images",
             "colors",
             "sizes",
@@ -112,9 +136,18 @@ class CreateReviewSerializer(serializers.ModelSerializer):
         return Review.objects.create(product_id=product_id, **validated_data)
 
 
+class ProductReviewSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Review
+        fields = ["id", "rating", "description", "date"]
+
+
 class ReviewSerializer(serializers.Serializer):
     total_reviews = serializers.IntegerField()
     rating = serializers.FloatField()
+    histogram = serializers.DictField(child=serializers.IntegerField())
+    next = serializers.URLField(allow_null=True)
+    results = ProductReviewSerializer(many=True)
 
 
 class SimpleProductSerializer(serializers.ModelSerializer):
@@ -123,7 +156,7 @@ class SimpleProductSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = ["id", "title", "unit_price", "product_url", "images"]
+        fields = ["id", "title", "unit_price", "rating", "product_url", "images"]
 
     def get_product_url(self, product):
         if product.is_digital:
@@ -141,22 +174,35 @@ class SimpleProductSerializer(serializers.ModelSerializer):
         return rep
 
 
+def color_hex_code(name):
+    color = reference_data.colors.get(name)
+    return color.hex_code if color else None
+
+
+class CartItemListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        # One pricing of the whole list, unless the cart already made it
+        if "pricing" not in self.context:
+            self.context["pricing"] = CartPricing.for_items(items)
+        return super().to_representation(items)
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
     total_price = serializers.SerializerMethodField()
     hex_code = serializers.SerializerMethodField()
 
     def get_total_price(self, cart_item: CartItem):
-        return cart_item.quantity * cart_item.resolved_price
+        pricing = self.context.get("pricing") or CartPricing.for_items([cart_item])
+        return pricing.item_total(cart_item)
 
     def get_hex_code(self, obj):
-        if obj.color:
-            color = Color.objects.get(name = obj.color)
-            return color.hex_code
-        return None
+        return color_hex_code(obj.color)
     class Meta:
         model = CartItem
         fields = ["id", "product", "quantity", "size", "color","hex_code", "total_price"]
+        list_serializer_class = CartItemListSerializer
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -164,8 +210,12 @@ class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     cart_total_price = serializers.SerializerMethodField()
 
+    def to_representation(self, cart):
+        self.context["pricing"] = CartPricing.for_items(cart.items.all())
+        return super().to_representation(cart)
+
     def get_cart_total_price(self, cart):
-        return sum([item.resolved_price for item in cart.items.all()])
+        return self.context["pricing"].total(cart.items.all())
 
     class Meta:
         model = Cart
@@ -178,114 +228,29 @@ class AddCartItemSerializer(serializers.ModelSerializer):
     color = serializers.CharField(required=False, allow_null=True, allow_blank=True)
     quantity = serializers.IntegerField()
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(
-                {"message": "No product with the given ID was found."}
-            )
-        return value
-
     def validate(self, attrs):
-        size = attrs.get("size", "")
-        color = attrs.get("color", "")
-        if size:
-            try:
-                size = Size.objects.get(size=size)
-            except Size.DoesNotExist:
-                raise serializers.ValidationError(
-                    {"message": "Invalid size object", "status": False}
-                )
-
-            if not SizeInventory.objects.filter(
-                size=size, product_id=attrs["product_id"]
-            ):
-                
-                raise serializers.ValidationError(
-                    {
-                        "message": "We don't have that size for this specific product!",
-                        "status": False,
-                    }
-                )
-            query = SizeInventory.objects.get(
-                size=size, product_id=attrs["product_id"]
-
-            )
-            if query.quantity <= 0:
-                raise serializers.ValidationError(
-                    {
-                        "message": "This size for this product is no longer in stock!",
-                        "status": False,
-                    }
-                )
-
-
-        if color:
-            try:
-                color = Color.objects.get(name=color)
-            except Color.DoesNotExist:
-                raise serializers.ValidationError(
-                    {"message": "Invalid color object", "status": False}
-                )
-
-            if not ColorInventory.objects.filter(
-                color=color, product_id=attrs["product_id"]
-            ):
-                raise serializers.ValidationError(
-                    {
-                        "message": "We don't have that color for this specific product!",
-                        "status": False,
-                    }
-                )
-            
-            query = ColorInventory.objects.get(
-                color=color, product_id=attrs["product_id"]
-
+        # Product, size and color stock in one query, every error at once
+        (errors,) = validate_items([attrs])
+        if errors:
+            raise serializers.ValidationError(
+                {
+                    "message": next(iter(errors.values())),
+                    "errors": errors,
+                    "status": False,
+                }
             )
-            if query.quantity <= 0:
-                raise serializers.ValidationError(
-                    {
-                        "message": "This color for this product is no longer in stock!",
-                        "status": False,
-                    }
-                )
         return super().validate(attrs)
 
     def create(self, validated_data):
-        cart_id = self.context["cart_id"]
-        product_id = validated_data["product_id"]
-        quantity = validated_data["quantity"]
-        size = validated_data.get("size", "")
         color = validated_data.get("color", "")
-
-        # Check if item already in cart to avoid duplicates
-        instance = CartItem.objects.filter(
-            cart_id=cart_id,
-            product_id=product_id,
-            size=size if size else None,
-            color=color if color else None,
-        ).first()
-
-        if instance:
-            # update quantity to the currently passed value
-            instance.quantity += quantity
-            instance.save()
-
-        else:
-            hex_code = None
-            if color:
-                color = Color.objects.get(name = color)
-                hex_code = color.hex_code
-
-            instance = CartItem.objects.create(
-                cart_id=cart_id,
-                product_id=product_id,
-                quantity=quantity,
-                size=size if size else None,
-                color=color if color else None,
-                hex_code = hex_code
-            )
-
-        return instance
+        return add_item(
+            self.context["cart_id"],
+            validated_data["product_id"],
+            validated_data["quantity"],
+            size=validated_data.get("size", ""),
+            color=color,
+            hex_code=color_hex_code(color) if color else None,
+        )
 
     class Meta:
         model = CartItem
@@ -298,6 +263,98 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
         fields = ["quantity"]
 
 
+class BatchAddCartItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    size = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+    color = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class BatchUpdateCartItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class CartItemBatchSerializer(serializers.Serializer):
+    """
+    Adds, quantity updates and removals of cart items applied together, see
+    CartItemViewSet.batch. Every add is validated with a single query.
+    """
+
+    add = BatchAddCartItemSerializer(many=True, required=False)
+    update = BatchUpdateCartItemSerializer(many=True, required=False)
+    remove = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def validate(self, attrs):
+        adds = attrs.get("add", [])
+        updates = attrs.get("update", [])
+        removals = attrs.get("remove", [])
+        if not (adds or updates or removals):
+            raise serializers.ValidationError(
+                {"message": "Nothing to add, update or remove", "status": False}
+            )
+
+        errors = {}
+        add_errors = {
+            index: item_errors
+            for index, item_errors in enumerate(validate_items(adds) if adds else [])
+            if item_errors
+        }
+        if add_errors:
+            errors["add"] = add_errors
+
+        item_ids = {item["id"] for item in updates} | set(removals)
+        existing = set(
+            CartItem.objects.filter(
+                cart_id=self.context["cart_id"], pk__in=item_ids
+            ).values_list("id", flat=True)
+        )
+        for name, ids in [
+            ("update", [item["id"] for item in updates]),
+            ("remove", removals),
+        ]:
+            missing = [pk for pk in ids if pk not in existing]
+            if missing:
+                errors[name] = {
+                    pk: "No item with the given ID in this cart." for pk in missing
+                }
+
+        if errors:
+            raise serializers.ValidationError(
+                {
+                    "message": "Some items are invalid, nothing was changed",
+                    "errors": errors,
+                    "status": False,
+                }
+            )
+        return attrs
+
+    def save(self, **kwargs):
+        cart_id = self.context["cart_id"]
+        updates = self.validated_data.get("update", [])
+        with transaction.atomic():
+            # Removals first, an add may bring the same item back
+            CartItem.objects.filter(
+                cart_id=cart_id, pk__in=self.validated_data.get("remove", [])
+            ).delete()
+            CartItem.objects.bulk_update(
+                [
+                    CartItem(pk=item["id"], quantity=item["quantity"])
+                    for item in updates
+                ],
+                ["quantity"],
+            )
+            add_items(
+                cart_id,
+                [
+                    dict(item, hex_code=color_hex_code(item.get("color")))
+                    for item in self.validated_data.get("add", [])
+                ],
+            )
+            # bulk_update() skips the CartItem signal handlers
+            Cart.objects.filter(pk=cart_id).update(last_update=timezone.now())
+
+
 class CustomerSerializer(serializers.ModelSerializer):
     user_id = serializers.IntegerField(read_only=True)
 
@@ -367,6 +424,7 @@ class CreateOrderSerializer(serializers.Serializer):
                     )
 
             customer = Customer.objects.get(id=self.context["user_id"])
+            pricing = CartPricing.for_items(cart_items)
 
             # order = Order(id  =  id_generator(Order),customer=customer)
 
@@ -375,7 +433,7 @@ class CreateOrderSerializer(serializers.Serializer):
                     id  =  id_generator(Order),
                     customer=customer,
                     product=item.product,
-                    price=item.resolved_price,
+                    price=pricing.item_total(item),
                     quantity=item.quantity,
                     size=item.size,
                     color=item.color,
@@ -1,6 +1,27 @@
-
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, NullIf
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from shop.models import TrackOrder
+from django.utils import timezone
+from likes.models import Like
+from likes.signals import like_toggled
+from shop import cache as catalog_cache
+from shop import popularity, reference_data, search
+from shop.autocomplete import title_index
+from shop.models import (
+    Cart,
+    CartItem,
+    Collection,
+    Color,
+    ColorInventory,
+    Product,
+    ProductImage,
+    Review,
+    Size,
+    SizeInventory,
+    TrackOrder,
+)
 from shop.signals import order_created
 
 @receiver(order_created)
@@ -13,3 +34,298 @@ def start_tracking(sender, **kwargs):
     )
     for order in kwargs['instances']]
     TrackOrder.objects.bulk_create(tracks)
+
+
+@receiver(order_created)
+def add_orders_to_popularity(sender, **kwargs):
+    for order in kwargs["instances"]:
+        popularity.record(order.product_id, "order", order.placed_at, order.quantity)
+    # Lists ordered by popularity
+    catalog_cache.invalidate_catalog()
+
+
+@receiver(post_save, sender=Like)
+def add_like_to_popularity(sender, instance, created, raw=False, **kwargs):
+    product_type = ContentType.objects.get_for_model(Product)
+    if created and not raw and instance.content_type_id == product_type.pk:
+        popularity.record(instance.object_id, "like", instance.created_at)
+
+
+@receiver(post_delete, sender=Like)
+def remove_like_from_popularity(sender, instance, **kwargs):
+    product_type = ContentType.objects.get_for_model(Product)
+    if instance.content_type_id == product_type.pk:
+        popularity.record(instance.object_id, "like", instance.created_at, count=-1)
+
+
+@receiver(post_save, sender=Like)
+def count_product_like(sender, instance, created, raw=False, **kwargs):
+    product_type = ContentType.objects.get_for_model(Product)
+    if created and not raw and instance.content_type_id == product_type.pk:
+        Product.objects.filter(pk=instance.object_id).update(
+            likes_count=F("likes_count") + 1
+        )
+
+
+@receiver(post_delete, sender=Like)
+def uncount_product_like(sender, instance, **kwargs):
+    product_type = ContentType.objects.get_for_model(Product)
+    if instance.content_type_id == product_type.pk:
+        Product.objects.filter(pk=instance.object_id).update(
+            likes_count=Greatest(F("likes_count") - 1, 0)
+        )
+
+
+@receiver(like_toggled, sender=Product)
+def count_toggled_product_like(sender, object_id, liked, created_at, **kwargs):
+    # One UPDATE of the counter and the popularity
+    if liked:
+        popularity.record(
+            object_id, "like", created_at, likes_count=F("likes_count") + 1
+        )
+    else:
+        popularity.record(
+            object_id,
+            "like",
+            created_at,
+            count=-1,
+            likes_count=Greatest(F("likes_count") - 1, 0),
+        )
+
+
+@receiver(post_save, sender=Review)
+def add_review_to_popularity(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        popularity.record(
+            instance.product_id, "review", popularity.review_time(instance)
+        )
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_popularity(sender, instance, **kwargs):
+    popularity.record(
+        instance.product_id, "review", popularity.review_time(instance), count=-1
+    )
+
+
+@receiver(post_save, sender=Review)
+def add_review_to_rating_stats(sender, instance, created, **kwargs):
+    products = Product.objects.filter(pk=instance.product_id)
+
+    if not created:
+        # The rating of an existing review may have changed
+        products.rebuild_rating_stats()
+        products.update(last_update=timezone.now())
+        return
+
+    stars = f"stars_{instance.rating}"
+    # Every expression reads the row as it was before the update
+    products.update(
+        last_update=timezone.now(),
+        review_count=F("review_count") + 1,
+        **{stars: F(stars) + 1},
+        rating_sum=F("rating_sum") + instance.rating,
+        average_rating=Cast(F("rating_sum") + instance.rating, FloatField())
+        / (F("review_count") + 1),
+    )
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_rating_stats(sender, instance, **kwargs):
+    stars = f"stars_{instance.rating}"
+    Product.objects.filter(pk=instance.product_id, review_count__gt=0).update(
+        last_update=timezone.now(),
+        review_count=F("review_count") - 1,
+        **{stars: Greatest(F(stars) - 1, 0)},
+        rating_sum=F("rating_sum") - instance.rating,
+        average_rating=Coalesce(
+            Cast(F("rating_sum") - instance.rating, FloatField())
+            / NullIf(F("review_count") - 1, Value(0)),
+            0.0,
+        ),
+    )
+
+
+@receiver(pre_save, sender=Product)
+def remember_stored_product(sender, instance, raw=False, **kwargs):
+    # The collection the product is moved out of, if it is, its inventory and
+    # its title
+    instance._previous_collection_id = instance._previous_inventory = None
+    instance._previous_title = None
+    if instance.pk is None or raw:
+        return
+    stored = (
+        Product.objects.filter(pk=instance.pk)
+        .values_list("collection_id", "inventory", "title")
+        .first()
+    )
+    if stored is not None:
+        (
+            instance._previous_collection_id,
+            instance._previous_inventory,
+            instance._previous_title,
+        ) = stored
+
+
+@receiver(pre_save, sender=Collection)
+def remember_stored_collection(sender, instance, raw=False, **kwargs):
+    instance._previous_title = None
+    if instance.pk is not None and not raw:
+        instance._previous_title = (
+            Collection.objects.filter(pk=instance.pk)
+            .values_list("title", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def update_product_stock(sender, instance, created, raw=False, **kwargs):
+    inventory_changed = instance.inventory != getattr(
+        instance, "_previous_inventory", None
+    )
+    if not raw and (created or inventory_changed):
+        Product.objects.filter(pk=instance.pk).rebuild_stock()
+
+
+@receiver(post_save, sender=SizeInventory)
+@receiver(post_delete, sender=SizeInventory)
+@receiver(post_save, sender=ColorInventory)
+@receiver(post_delete, sender=ColorInventory)
+def update_variant_stock(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Product.objects.filter(pk=instance.product_id).rebuild_stock()
+
+
+@receiver(post_save, sender=Product)
+def count_product_in_collection(sender, instance, created, raw=False, **kwargs):
+    previous = getattr(instance, "_previous_collection_id", None)
+    if raw or (not created and previous in (None, instance.collection_id)):
+        return
+
+    # The stored count is part of the collection list payload
+    now = timezone.now()
+    Collection.objects.filter(pk=instance.collection_id).update(
+        products_count=F("products_count") + 1, last_update=now
+    )
+    if not created:
+        Collection.objects.filter(pk=previous, products_count__gt=0).update(
+            products_count=F("products_count") - 1, last_update=now
+        )
+
+
+@receiver(post_delete, sender=Product)
+def uncount_product_in_collection(sender, instance, **kwargs):
+    Collection.objects.filter(pk=instance.collection_id, products_count__gt=0).update(
+        products_count=F("products_count") - 1, last_update=timezone.now()
+    )
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Collection)
+def reindex_collection_products(sender, instance, created, raw=False, **kwargs):
+    # The collection title is part of the search document of its products
+    if not created and not raw:
+        search.index_products(instance.products.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Product)
+def update_product_suggestions(sender, instance, created, raw=False, **kwargs):
+    # Every other worker replays the change, skip the saves keeping the title
+    previous = getattr(instance, "_previous_title", None)
+    if not raw and (created or instance.title != previous):
+        title_index.product_changed(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_suggestions(sender, instance, **kwargs):
+    title_index.product_changed(instance, deleted=True)
+
+
+@receiver(post_save, sender=Collection)
+def update_collection_suggestions(sender, instance, created, raw=False, **kwargs):
+    previous = getattr(instance, "_previous_title", None)
+    if not raw and (created or instance.title != previous):
+        title_index.collection_changed(instance)
+
+
+@receiver(post_delete, sender=Collection)
+def remove_collection_suggestions(sender, instance, **kwargs):
+    title_index.collection_changed(instance, deleted=True)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_cached_product(sender, instance, **kwargs):
+    catalog_cache.invalidate_products([instance.pk])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=SizeInventory)
+@receiver(post_delete, sender=SizeInventory)
+@receiver(post_save, sender=ColorInventory)
+@receiver(post_delete, sender=ColorInventory)
+def touch_parent_product(sender, instance, **kwargs):
+    # Product.last_update is the Last-Modified of the whole product payload
+    Product.objects.filter(pk=instance.product_id).update(last_update=timezone.now())
+    catalog_cache.invalidate_products([instance.product_id])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_cached_reviewed_product(sender, instance, **kwargs):
+    catalog_cache.invalidate_products([instance.product_id])
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def touch_cart(sender, instance, **kwargs):
+    Cart.objects.filter(pk=instance.cart_id).update(last_update=timezone.now())
+
+
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def invalidate_cached_product_lists(sender, instance, **kwargs):
+    catalog_cache.invalidate_catalog()
+
+
+def touch_products(product_ids):
+    product_ids = list(product_ids)
+    Product.objects.filter(pk__in=product_ids).update(last_update=timezone.now())
+    catalog_cache.invalidate_products(product_ids)
+
+
+@receiver(post_save, sender=Size)
+def touch_products_of_size(sender, instance, created, **kwargs):
+    # Sizes and colors are nested in the product payloads, a renamed one
+    # changes the payload of every product using it
+    if not created:
+        touch_products(instance.product_size.values_list("product_id", flat=True))
+
+
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+def invalidate_sizes(sender, instance, raw=False, **kwargs):
+    reference_data.sizes.invalidate()
+
+
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+def invalidate_colors(sender, instance, raw=False, **kwargs):
+    reference_data.colors.invalidate()
+
+
+@receiver(post_save, sender=Color)
+def touch_products_of_color(sender, instance, created, **kwargs):
+    if not created:
+        touch_products(instance.product_color.values_list("product_id", flat=True))
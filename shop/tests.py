@@ -1,3 +1,1391 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from likes.models import Like
+from shop import fast_serializers, popularity, reference_data
+from shop.admin import ProductAdmin
+from shop.autocomplete import VERSION_KEY, Autocomplete, title_index
+from shop.cart_items import add_item, validate_items
+from shop.export import export_products
+from shop.pricing import CartPricing
+
+from shop.models import (
+    RATINGS,
+    Cart,
+    CartItem,
+    Collection,
+    Color,
+    ColorInventory,
+    Order,
+    Product,
+    ProductImage,
+    RelatedProduct,
+    Review,
+    Size,
+    SizeInventory,
+)
+from shop.serializers import CartSerializer, ProductSerializer, SimpleProductSerializer
+from shop.views import product_listing_queryset
+
+User = get_user_model()
+
+
+def create_product(collection, index, **kwargs):
+    fields = {"title": f"Product {index}", "unit_price": 10, "inventory": 5, **kwargs}
+    product = Product.objects.create(collection=collection, **fields)
+    ProductImage.objects.create(product=product, image=f"store/images/{index}.jpg")
+    return product
+
+
+class CatalogTestCase(APITestCase):
+    """Shared fixtures: a collection, a size, two colors, a user and a cart."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title="Shoes")
+        cls.size = Size.objects.create(size="XL")
+        cls.red = Color.objects.create(name="Red", hex_code="#ff0000")
+        cls.blue = Color.objects.create(name="Blue", hex_code="#0000ff")
+        cls.user = User.objects.bulk_create(
+            [User(username="alice", email="alice@example.com")]
+        )[0]
+        cls.cart = Cart.objects.create()
+
+    def setUp(self):
+        cache.clear()
+        # Rows cached by a previous test were rolled back
+        reference_data.colors.clear()
+        reference_data.sizes.clear()
+
+
+class ProductListQueriesTest(CatalogTestCase):
+    def create_products(self, count):
+        for index in range(Product.objects.count(), count):
+            product = create_product(self.collection, index)
+            SizeInventory.objects.create(product=product, size=self.size, quantity=2)
+            ColorInventory.objects.create(product=product, color=self.red, quantity=3)
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/shop/products")
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.data["results"]
+
+    def test_list_page_has_a_fixed_number_of_queries(self):
+        self.create_products(2)
+        small_page_queries, results = self.count_list_queries()
+        self.assertEqual(len(results), 2)
+
+        self.create_products(10)
+        full_page_queries, results = self.count_list_queries()
+        self.assertEqual(len(results), 10)
+
+        # count, products, images, sizes, colors
+        self.assertEqual(small_page_queries, 5)
+        self.assertEqual(full_page_queries, small_page_queries)
+
+    def test_list_exposes_annotated_stats(self):
+        self.create_products(1)
+        _, results = self.count_list_queries()
+
+        self.assertEqual(results[0]["variant_stock"], 5)
+        self.assertEqual(results[0]["likes_count"], 0)
+        self.assertEqual(results[0]["rating"], 1.0)
+
+
+class ProductSearchTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        collection = Collection.objects.create(title="Footwear")
+        self.shoes = create_product(
+            collection, 1, description="Light shoes for running long distances"
+        )
+        self.shoes.title = "Red running shoes"
+        self.shoes.save()
+        self.hat = create_product(collection, 2, description="Goes with running shoes")
+
+    def test_results_are_ranked_and_highlighted(self):
+        response = self.client.get("/shop/products/search", {"q": "runn"})
+
+        self.assertEqual(response.data["count"], 2)
+        first = response.data["results"][0]
+        self.assertEqual(first["id"], self.shoes.id)
+        self.assertEqual(first["search"]["title"], "Red <mark>running</mark> shoes")
+
+    def test_catalog_html_is_escaped(self):
+        self.hat.title = "<b>Sun</b> hat"
+        self.hat.description = "<script>alert(1)</script> sun & rain"
+        self.hat.save()
+
+        response = self.client.get("/shop/products/search", {"q": "sun"})
+        hit = response.data["results"][0]["search"]
+        self.assertEqual(hit["title"], "&lt;b&gt;<mark>Sun</mark>&lt;/b&gt; hat")
+        self.assertNotIn("<script>", hit["snippet"])
+        self.assertIn("<mark>sun</mark> &amp; rain", hit["snippet"])
+
+    def test_index_follows_deletes_and_collection_renames(self):
+        self.hat.delete()
+        self.shoes.collection.title = "Sneakers"
+        self.shoes.collection.save()
+
+        response = self.client.get("/shop/products/search", {"q": "sneak"})
+        self.assertEqual(
+            [item["id"] for item in response.data["results"]], [self.shoes.id]
+        )
+        response = self.client.get("/shop/products/search", {"q": "footwear"})
+        self.assertEqual(response.data["count"], 0)
+
+    def test_cursor_is_ignored(self):
+        response = self.client.get("/shop/products/search", {"q": "runn", "cursor": ""})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 2)
+
+
+class KeysetPaginationTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        for index in range(25):
+            create_product(self.collection, index % 5)
+
+    def test_cursor_walks_every_product_once(self):
+        seen, url = [], "/shop/products?cursor=&page_size=10"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["count"], 25)
+            seen += [(item["title"], item["id"]) for item in response.data["results"]]
+            url = response.data["next"]
+
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(set(seen)), 25)
+
+    def test_descending_ordering_without_count(self):
+        response = self.client.get(
+            "/shop/products",
+            {
+                "cursor": "",
+                "ordering": "-last_update",
+                "count": "false",
+                "page_size": 20,
+            },
+        )
+        second = self.client.get(response.data["next"])
+
+        self.assertNotIn("count", response.data)
+        ids = [item["id"] for item in response.data["results"] + second.data["results"]]
+        expected = Product.objects.order_by("-last_update", "-id")
+        self.assertEqual(ids, list(expected.values_list("id", flat=True)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/shop/products", {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 404)
+
+
+class CatalogCacheTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.first = create_product(self.collection, 1)
+        self.second = create_product(self.collection, 2)
+
+    def test_repeated_requests_are_served_from_cache(self):
+        response = self.client.get(f"/shop/products/{self.first.id}")
+        self.assertEqual(response["X-Cache"], "MISS")
+
+        # Only the conditional GET validators hit the database
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/shop/products/{self.first.id}")
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(response.data["title"], "Product 1")
+
+    def test_query_parameters_are_normalized(self):
+        self.client.get("/shop/products?collection_id=1&ordering=unit_price")
+        response = self.client.get("/shop/products?ordering=unit_price&collection_id=1")
+        self.assertEqual(response["X-Cache"], "HIT")
+
+    def test_writes_invalidate_only_affected_products(self):
+        self.client.get(f"/shop/products/{self.first.id}")
+        self.client.get(f"/shop/products/{self.second.id}")
+        self.client.get("/shop/products")
+
+        Review.objects.create(product=self.first, rating=4, description="Nice")
+
+        response = self.client.get(f"/shop/products/{self.first.id}")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["rating"], 4.0)
+        response = self.client.get(f"/shop/products/{self.second.id}")
+        self.assertEqual(response["X-Cache"], "HIT")
+        response = self.client.get("/shop/products")
+        self.assertEqual(response["X-Cache"], "MISS")
+
+    def test_versions_are_bumped_again_on_commit(self):
+        url = f"/shop/products/{self.first.id}"
+        with self.captureOnCommitCallbacks() as callbacks:
+            Review.objects.create(product=self.first, rating=4, description="Nice")
+            # Cached under the new version before the commit
+            self.assertEqual(self.client.get(url)["X-Cache"], "MISS")
+        self.assertEqual(self.client.get(url)["X-Cache"], "HIT")
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(url)["X-Cache"], "MISS")
+
+
+class ConditionalGetTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_product(self.collection, 1)
+
+    def assertNotModifiedUntilChanged(self, url, change, last_modified=True):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertEqual(response.has_header("Last-Modified"), last_modified)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_product_detail(self):
+        self.assertNotModifiedUntilChanged(
+            f"/shop/products/{self.product.id}",
+            lambda: SizeInventory.objects.create(
+                product=self.product, size=Size.objects.create(size="M")
+            ),
+        )
+
+    def test_product_detail_follows_sizes_and_colors(self):
+        SizeInventory.objects.create(product=self.product, size=self.size)
+        ColorInventory.objects.create(product=self.product, color=self.red)
+
+        def rename_size():
+            self.size.size = "Medium"
+            self.size.save()
+
+        def change_hex_code():
+            self.red.hex_code = "#ee0000"
+            self.red.save()
+
+        url = f"/shop/products/{self.product.id}"
+        self.assertNotModifiedUntilChanged(url, rename_size)
+        self.assertNotModifiedUntilChanged(url, change_hex_code)
+
+    def test_product_detail_follows_cleared_inventory(self):
+        admin = ProductAdmin(Product, AdminSite())
+        request = APIRequestFactory().post("/admin/shop/product/")
+        admin.message_user = lambda *args, **kwargs: None
+        self.assertNotModifiedUntilChanged(
+            f"/shop/products/{self.product.id}",
+            lambda: admin.clear_inventory(
+                request, Product.objects.filter(pk=self.product.pk)
+            ),
+        )
+
+    def test_product_list(self):
+        self.assertNotModifiedUntilChanged(
+            "/shop/products", lambda: self.product.delete(), last_modified=False
+        )
+
+    def test_product_list_validators_skip_the_database(self):
+        for params in [{}, {"cursor": "", "count": "false"}]:
+            etag = self.client.get("/shop/products", params)["ETag"]
+            with self.assertNumQueries(0):
+                response = self.client.get(
+                    "/shop/products", params, HTTP_IF_NONE_MATCH=etag
+                )
+            self.assertEqual(response.status_code, 304)
+
+    def test_collection_list(self):
+        self.assertNotModifiedUntilChanged(
+            "/shop/collections",
+            lambda: create_product(self.collection, 2),
+            last_modified=False,
+        )
+
+    def test_cart(self):
+        self.assertNotModifiedUntilChanged(
+            f"/shop/carts/{self.cart.id}",
+            lambda: CartItem.objects.create(
+                cart=self.cart, product=self.product, quantity=1
+            ),
+        )
+
+    def test_if_modified_since(self):
+        response = self.client.get(f"/shop/products/{self.product.id}")
+        response = self.client.get(
+            f"/shop/products/{self.product.id}",
+            HTTP_IF_MODIFIED_SINCE=response["Last-Modified"],
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_ignores_if_modified_since_after_delete(self):
+        create_product(self.collection, 2).delete()
+        response = self.client.get(
+            "/shop/products",
+            HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60),
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class ProductFacetsTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        hats = Collection.objects.create(title="Hats")
+
+        self.cheap_red_shoe = create_product(self.collection, 1)
+        ColorInventory.objects.create(product=self.cheap_red_shoe, color=self.red)
+        self.blue_shoe = create_product(self.collection, 2, is_digital=False)
+        self.blue_shoe.unit_price = 80
+        self.blue_shoe.save()
+        ColorInventory.objects.create(product=self.blue_shoe, color=self.blue)
+        ColorInventory.objects.create(product=self.blue_shoe, color=self.red)
+        self.hat = create_product(hats, 3)
+        self.hat.inventory = 0
+        self.hat.save()
+
+    def test_filters(self):
+        response = self.client.get("/shop/products", {"color": "Red,Blue"})
+        self.assertEqual(response.data["count"], 2)
+        response = self.client.get("/shop/products", {"min_price": 50})
+        self.assertEqual(
+            [p["id"] for p in response.data["results"]], [self.blue_shoe.id]
+        )
+        response = self.client.get("/shop/products", {"in_stock": "false"})
+        self.assertEqual([p["id"] for p in response.data["results"]], [self.hat.id])
+
+    def test_facets_exclude_their_own_filter(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                "/shop/products/facets",
+                {"color": "Blue", "collection_id": self.hat.collection_id},
+            )
+        facets = response.data["data"]
+
+        # Other collections are still counted for the blue products
+        self.assertEqual(
+            [(c["title"], c["count"]) for c in facets["collections"]], [("Shoes", 1)]
+        )
+        # Colors are counted within the selected collection only
+        self.assertEqual(facets["colors"], [])
+
+        response = self.client.get("/shop/products/facets", {"color": "Red"})
+        facets = response.data["data"]
+        self.assertEqual(
+            [(c["name"], c["count"]) for c in facets["colors"]],
+            [("Red", 2), ("Blue", 1)],
+        )
+        buckets = {b["min_price"]: b["count"] for b in facets["price_ranges"]}
+        self.assertEqual(buckets[0], 1)
+        self.assertEqual(buckets[50], 1)
+
+
+class SparseFieldsetTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_product(self.collection, 1)
+
+    def test_fields_prune_payload_and_prefetches(self):
+        # count, products
+        with self.assertNumQueries(2):
+            response = self.client.get("/shop/products", {"fields": "id,title"})
+        self.assertEqual(set(response.data["results"][0]), {"id", "title"})
+
+    def test_expand_adds_relations_to_plain_fields(self):
+        # validators, products, images
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                f"/shop/products/{self.product.id}", {"expand": "images"}
+            )
+        self.assertIn("images", response.data)
+        self.assertIn("unit_price", response.data)
+        self.assertNotIn("colors", response.data)
+
+    def test_unknown_fields(self):
+        response = self.client.get("/shop/products", {"fields": "id,secret"})
+        self.assertEqual(response.status_code, 400)
+
+
+class FastSerializerEquivalenceTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.request = APIRequestFactory().get("/shop/products")
+        self.products = [create_product(self.collection, index) for index in range(3)]
+        first, second, _ = self.products
+        ProductImage.objects.create(product=first, image="store/images/extra.jpg")
+        SizeInventory.objects.create(
+            product=first, size=self.size, quantity=2, extra_price="1.50"
+        )
+        ColorInventory.objects.create(product=first, color=self.red, quantity=3)
+        ColorInventory.objects.create(
+            product=second, color=self.blue, quantity=1, extra_price="2.25"
+        )
+        Review.objects.create(product=first, rating=4, description="Good")
+
+        CartItem.objects.create(
+            cart=self.cart, product=first, quantity=2, size="XL", color="Red"
+        )
+        CartItem.objects.create(
+            cart=self.cart, product=second, quantity=1, color="Blue"
+        )
+
+    def as_json(self, data):
+        return json.loads(JSONRenderer().render(data))
+
+    def test_products(self):
+        queryset = product_listing_queryset()
+        expected = ProductSerializer(
+            queryset, many=True, context={"request": self.request}
+        ).data
+        rows = fast_serializers.product_rows(queryset)
+
+        self.assertEqual(
+            self.as_json(fast_serializers.render_products(rows, self.request)),
+            self.as_json(expected),
+        )
+
+    def test_sparse_fields(self):
+        fields = ["id", "unit_price", "rating", "sizes"]
+        queryset = product_listing_queryset(fields)
+        expected = ProductSerializer(queryset, many=True, fields=fields).data
+        rows = fast_serializers.product_rows(queryset, fields)
+
+        self.assertEqual(
+            self.as_json(fast_serializers.render_products(rows, fields=fields)),
+            self.as_json(expected),
+        )
+
+    def test_simple_products(self):
+        expected = SimpleProductSerializer(
+            Product.objects.all(), many=True, context={"request": self.request}
+        ).data
+        rows = fast_serializers.product_rows(
+            Product.objects.all(), fast_serializers.SIMPLE_PRODUCT_FIELDS
+        )
+
+        self.assertEqual(
+            self.as_json(fast_serializers.render_simple_products(rows, self.request)),
+            self.as_json(expected),
+        )
+
+    def test_cart(self):
+        expected = CartSerializer(self.cart, context={"request": self.request}).data
+
+        self.assertEqual(
+            self.as_json(fast_serializers.render_cart(self.cart.id, self.request)),
+            self.as_json(expected),
+        )
+
+
+class BulkProductsTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = [create_product(self.collection, index) for index in range(3)]
+
+    def test_requested_order_and_missing_ids(self):
+        first, second, third = [product.id for product in self.products]
+        # products, images, sizes, colors
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                "/shop/products/bulk", {"ids": f"{third},999,{first},{third}"}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        ids = [item["id"] for item in response.data["results"]]
+        self.assertEqual(ids, [third, first])
+        self.assertEqual(response.data["missing"], [999])
+
+    def test_invalid_and_too_many_ids(self):
+        for ids in ["1,abc", "99999999999999999999", str(2**63), "1,0", "-1"]:
+            response = self.client.get("/shop/products/bulk", {"ids": ids})
+            self.assertEqual(response.status_code, 400)
+
+        ids = ",".join(str(pk) for pk in range(1, 52))
+        response = self.client.get("/shop/products/bulk", {"ids": ids})
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogExportTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = [create_product(self.collection, index) for index in range(5)]
+        self.staff = User.objects.bulk_create(
+            [User(username="staff", email="staff@example.com", is_staff=True)]
+        )[0]
+
+    def export(self, **params):
+        response = self.client.get("/shop/products/export", params)
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        return [json.loads(line) for line in lines]
+
+    def test_requires_staff(self):
+        response = self.client.get("/shop/products/export")
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_streams_every_product_in_chunks(self):
+        self.client.force_authenticate(self.staff)
+        lines = list(export_products(chunk_size=2))
+        self.assertEqual(len(lines), 5)
+
+        products = self.export()
+        self.assertEqual(
+            [product["id"] for product in products],
+            [product.id for product in self.products],
+        )
+        self.assertEqual(len(products[0]["images"]), 1)
+        self.assertIn("last_update", products[0])
+
+    def test_updated_since(self):
+        self.client.force_authenticate(self.staff)
+        Product.objects.filter(pk=self.products[0].pk).update(
+            last_update=timezone.now() - timedelta(days=10)
+        )
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+
+        products = self.export(updated_since=since)
+        self.assertEqual(len(products), 4)
+
+        response = self.client.get("/shop/products/export", {"updated_since": "soon"})
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogImportTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.existing = create_product(self.collection, 1)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as output:
+            output.write(content)
+        return path
+
+    def test_ndjson_creates_and_updates_in_chunks(self):
+        records = [
+            {
+                "id": self.existing.id,
+                "title": "Renamed",
+                "unit_price": "12.50",
+                "collection": "Shoes",
+                "colors": [{"name": "Red", "hex_code": "#ee0000", "quantity": 2}],
+            },
+            {
+                "title": "Runner",
+                "unit_price": 30,
+                "inventory": 4,
+                "collection": "Sneakers",
+                "images": ["store/images/runner.jpg"],
+                "sizes": [{"size": "XL", "quantity": 3, "extra_price": "1.50"}],
+            },
+            {"title": "Walker", "unit_price": 20, "collection": "Sneakers"},
+        ]
+        path = self.write(
+            "catalog.ndjson", "\n".join(json.dumps(record) for record in records)
+        )
+
+        call_command("import_catalog", path, chunk_size=2, stdout=io.StringIO())
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.title, "Renamed")
+        self.assertEqual(self.existing.color_inventory.get().quantity, 2)
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.hex_code, "#ee0000")
+
+        runner = Product.objects.get(title="Runner")
+        self.assertEqual(runner.collection.title, "Sneakers")
+        self.assertEqual(runner.size_inventory.get().size.size, "XL")
+        self.assertEqual(runner.images.count(), 1)
+        self.assertEqual(Collection.objects.get(title="Sneakers").products_count, 2)
+        self.assertEqual(
+            self.client.get("/shop/products/search", {"q": "walker"}).data["count"], 1
+        )
+
+    def test_csv_resumes_after_a_failed_chunk(self):
+        path = self.write(
+            "catalog.csv",
+            "title,unit_price,collection,sizes\n"
+            'Runner,30,Shoes,"[{""size"": ""M"", ""quantity"": 1}]"\n'
+            "Walker,oops,Shoes,\n",
+        )
+        checkpoint = os.path.join(self.directory.name, "checkpoint")
+
+        with self.assertRaises(CommandError):
+            call_command(
+                "import_catalog",
+                path,
+                chunk_size=1,
+                checkpoint=checkpoint,
+                stdout=io.StringIO(),
+            )
+        self.assertTrue(Product.objects.filter(title="Runner").exists())
+        self.assertFalse(Product.objects.filter(title="Walker").exists())
+
+        with open(path) as source:
+            self.write("catalog.csv", source.read().replace("oops", "20"))
+        call_command(
+            "import_catalog",
+            path,
+            chunk_size=1,
+            checkpoint=checkpoint,
+            stdout=io.StringIO(),
+        )
+        self.assertEqual(Product.objects.filter(title="Runner").count(), 1)
+        self.assertTrue(Product.objects.filter(title="Walker").exists())
+
+
+class CollectionProductsCountTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shirts = Collection.objects.create(title="Shirts")
+
+    def counts(self):
+        return dict(Collection.objects.values_list("title", "products_count"))
+
+    def test_kept_in_sync_with_products(self):
+        first = create_product(self.collection, 1)
+        create_product(self.collection, 2)
+        self.assertEqual(self.counts(), {"Shoes": 2, "Shirts": 0})
+
+        first.collection = self.shirts
+        first.save()
+        self.assertEqual(self.counts(), {"Shoes": 1, "Shirts": 1})
+
+        first.title = "Renamed"
+        first.save()
+        self.assertEqual(self.counts(), {"Shoes": 1, "Shirts": 1})
+
+        first.delete()
+        self.assertEqual(self.counts(), {"Shoes": 1, "Shirts": 0})
+
+    def test_list_is_a_plain_read(self):
+        create_product(self.collection, 1)
+        # validators, collections
+        with self.assertNumQueries(2):
+            response = self.client.get("/shop/collections")
+        counts = {item["title"]: item["products_count"] for item in response.data}
+        self.assertEqual(counts, {"Shoes": 1, "Shirts": 0})
+
+    def test_repair_command(self):
+        create_product(self.collection, 1)
+        Collection.objects.update(products_count=7)
+
+        call_command("rebuild_products_count", stdout=io.StringIO())
+        self.assertEqual(self.counts(), {"Shoes": 1, "Shirts": 0})
+
+
+class RelatedProductsTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shoe, self.sock, self.lace, self.hat = [
+            create_product(self.collection, index) for index in range(4)
+        ]
+        self.bob = User.objects.bulk_create(
+            [User(username="bob", email="bob@example.com")]
+        )[0]
+
+    def order(self, customer, product, hours_ago):
+        order = Order.objects.create(
+            id=f"O{Order.objects.count()}",
+            customer=customer,
+            product=product,
+            quantity=1,
+            price=product.unit_price,
+        )
+        Order.objects.filter(pk=order.pk).update(
+            placed_at=timezone.now() - timedelta(hours=hours_ago)
+        )
+
+    def test_neighbors_of_baskets(self):
+        # Two baskets with the shoe and the sock, one with the lace
+        self.order(self.user, self.shoe, 100)
+        self.order(self.user, self.sock, 99)
+        self.order(self.user, self.hat, 10)
+        self.order(self.bob, self.shoe, 5)
+        self.order(self.bob, self.sock, 5)
+        self.order(self.bob, self.lace, 4)
+
+        call_command("build_related_products", window_hours=24, stdout=io.StringIO())
+
+        # product, images, sizes, colors
+        with self.assertNumQueries(5):
+            response = self.client.get(f"/shop/products/{self.shoe.id}/related")
+        ids = [item["id"] for item in response.data["results"]]
+        self.assertEqual(ids, [self.sock.id, self.lace.id])
+        # The hat was bought in a basket of its own
+        self.assertFalse(RelatedProduct.objects.filter(product=self.hat).exists())
+
+    def test_unknown_product(self):
+        response = self.client.get("/shop/products/999/related")
+        self.assertEqual(response.status_code, 404)
+
+
+class PopularityTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.old, self.new, self.quiet = [
+            create_product(self.collection, index) for index in range(3)
+        ]
+        self.product_type = ContentType.objects.get_for_model(Product)
+
+    def like(self, product):
+        return Like.objects.create(
+            user=self.user, content_type=self.product_type, object_id=product.id
+        )
+
+    def test_recent_events_outrank_older_ones(self):
+        # Two reviews a month ago against a single like now
+        for _ in range(2):
+            Review.objects.create(product=self.old, rating=5, description="Good")
+        Review.objects.filter(product=self.old).update(
+            date=timezone.now().date() - timedelta(days=30)
+        )
+        popularity.rebuild_popularity()
+        self.like(self.new)
+
+        response = self.client.get("/shop/products/trending", {"limit": 2})
+        ids = [item["id"] for item in response.data["results"]]
+        self.assertEqual(ids, [self.new.id, self.old.id])
+        self.assertAlmostEqual(response.data["results"][0]["popularity"], 1.0, 3)
+
+        ordered = self.client.get("/shop/products", {"ordering": "-popularity"})
+        self.assertEqual(ordered.data["results"][0]["id"], self.new.id)
+
+    def test_removed_events_are_subtracted(self):
+        like = self.like(self.new)
+        like.delete()
+        self.new.refresh_from_db()
+        self.assertAlmostEqual(self.new.popularity, 0.0)
+
+    def test_keyset_ordering(self):
+        self.like(self.quiet)
+        response = self.client.get(
+            "/shop/products", {"cursor": "", "ordering": "-popularity", "page_size": 2}
+        )
+        second = self.client.get(response.data["next"])
+        ids = [item["id"] for item in response.data["results"] + second.data["results"]]
+        self.assertEqual(ids[0], self.quiet.id)
+        self.assertEqual(len(set(ids)), 3)
+
+
+class AutocompleteTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shoes = Collection.objects.create(title="Running Shoes")
+        self.runner = create_product(self.shoes, 1, title="Trail Runner")
+        self.sandal = create_product(self.shoes, 2, title="Rünning Sandal")
+        Product.objects.filter(pk=self.sandal.pk).update(popularity=5.0)
+        title_index.build()
+
+    def suggest(self, query):
+        response = self.client.get("/shop/products/autocomplete", {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return response.data["results"]
+
+    def test_prefix_of_any_word_ranked_by_popularity(self):
+        with self.assertNumQueries(0):
+            results = self.suggest("RUN")
+        titles = [item["title"] for item in results["products"]]
+        self.assertEqual(titles, ["Rünning Sandal", "Trail Runner"])
+        self.assertEqual(results["collections"][0]["title"], "Running Shoes")
+
+        titles = [item["title"] for item in self.suggest("tra run")["products"]]
+        self.assertEqual(titles, ["Trail Runner"])
+
+    def test_index_follows_saves_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.runner.title = "Mountain Boot"
+            self.runner.save()
+        self.assertEqual(len(self.suggest("trail")["products"]), 0)
+        self.assertEqual(len(self.suggest("mount")["products"]), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sandal.delete()
+        self.assertEqual(len(self.suggest("sand")["products"]), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Collection.objects.create(title="Sandals")
+        self.assertEqual(len(self.suggest("sand")["collections"]), 1)
+
+    def test_index_changes_wait_for_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.runner.title = "Mountain Boot"
+            self.runner.save()
+        self.assertEqual(len(self.suggest("trail")["products"]), 1)
+        self.assertEqual(len(self.suggest("mount")["products"]), 0)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(self.suggest("mount")["products"]), 1)
+
+    def test_other_workers_replay_changes(self):
+        worker = Autocomplete()
+        worker.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.runner.title = "Mountain Boot"
+            self.runner.save()
+            Collection.objects.create(title="Sandals")
+
+        worker.version_checked_at = 0
+        with self.assertNumQueries(0):
+            self.assertEqual(len(worker.suggest("trail")["products"]), 0)
+            self.assertEqual(len(worker.suggest("mount")["products"]), 1)
+            self.assertEqual(len(worker.suggest("sand")["collections"]), 1)
+
+        title_index.invalidate()
+        worker.version_checked_at = 0
+        # Rebuilt from both tables
+        with self.assertNumQueries(2):
+            worker.suggest("mount")
+
+    def test_saves_keeping_the_title_are_not_published(self):
+        version = cache.get(VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.runner.inventory = 3
+            self.runner.save()
+            self.shoes.save()
+        self.assertEqual(cache.get(VERSION_KEY), version)
+
+
+class ProductStockTest(CatalogTestCase):
+    def stock(self, product):
+        return Product.objects.values_list(
+            "variant_stock", "total_available", "in_stock"
+        ).get(pk=product.pk)
+
+    def test_follows_every_inventory_source(self):
+        product = create_product(self.collection, 1, inventory=0)
+        self.assertEqual(self.stock(product), (0, 0, False))
+
+        variant = SizeInventory.objects.create(
+            product=product, size=self.size, quantity=3
+        )
+        self.assertEqual(self.stock(product), (3, 3, True))
+
+        product.refresh_from_db()
+        product.inventory = 2
+        product.save()
+        self.assertEqual(self.stock(product), (3, 5, True))
+
+        variant.delete()
+        self.assertEqual(self.stock(product), (0, 2, True))
+
+    def test_in_stock_filter(self):
+        available = create_product(self.collection, 1)
+        create_product(self.collection, 2, inventory=0)
+
+        response = self.client.get("/shop/products", {"in_stock": "true"})
+        self.assertEqual(
+            [item["id"] for item in response.data["results"]], [available.id]
+        )
+        self.assertTrue(response.data["results"][0]["in_stock"])
+
+
+class ProductRatingStatsTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_product(self.collection, 1)
+
+    def assertStats(self, review_count, rating_sum, average_rating, histogram):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, review_count)
+        self.assertEqual(self.product.rating_sum, rating_sum)
+        self.assertAlmostEqual(self.product.average_rating, average_rating)
+        self.assertEqual(
+            [self.product.rating_histogram[rating] for rating in RATINGS], histogram
+        )
+
+    def review(self, rating):
+        return Review.objects.create(
+            product=self.product, rating=rating, description=""
+        )
+
+    def test_stats_follow_reviews(self):
+        five = self.review(5)
+        four = self.review(4)
+        self.assertStats(2, 9, 4.5, [0, 0, 0, 1, 1])
+
+        four.rating = 2
+        four.save()
+        self.assertStats(2, 7, 3.5, [0, 1, 0, 0, 1])
+
+        five.delete()
+        self.assertStats(1, 2, 2.0, [0, 1, 0, 0, 0])
+
+        four.delete()
+        self.assertStats(0, 0, 0.0, [0, 0, 0, 0, 0])
+
+    def test_rebuild_repairs_drifted_stats(self):
+        for rating in [5, 3, 3]:
+            self.review(rating)
+        other = create_product(self.product.collection, 2)
+        Product.objects.update(
+            review_count=7, rating_sum=1, average_rating=0.5, stars_1=4, stars_3=0
+        )
+
+        call_command("rebuild_rating_stats", str(self.product.pk), stdout=io.StringIO())
+        self.assertStats(3, 11, 11 / 3, [0, 0, 2, 0, 1])
+        other.refresh_from_db()
+        self.assertEqual(other.review_count, 7)
+
+        Product.objects.filter(pk=other.pk).rebuild_rating_stats()
+        other.refresh_from_db()
+        self.assertEqual(
+            (other.review_count, other.rating_sum, other.average_rating, other.stars_1),
+            (0, 0, 0.0, 0),
+        )
+
+
+class ProductReviewsTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_product(self.collection, 1)
+        self.url = f"/shop/products/{self.product.id}/reviews"
+
+    def test_histogram_follows_reviews(self):
+        for rating in [5, 5, 4, 1]:
+            Review.objects.create(product=self.product, rating=rating, description="")
+        Review.objects.filter(rating=1).get().delete()
+        edited = Review.objects.filter(rating=4).get()
+        edited.rating = 3
+        edited.save()
+
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data["total_reviews"], 3)
+        self.assertAlmostEqual(response.data["rating"], 13 / 3)
+        self.assertEqual(response.data["histogram"], {1: 0, 2: 0, 3: 1, 4: 0, 5: 2})
+
+        Product.objects.update(stars_5=0, stars_3=0)
+        call_command("rebuild_rating_stats", stdout=io.StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_histogram[5], 2)
+        self.assertEqual(self.product.rating_histogram[3], 1)
+
+    def test_reviews_are_keyset_paginated(self):
+        reviews = [
+            Review.objects.create(
+                product=self.product, rating=index % 5 + 1, description=""
+            )
+            for index in range(15)
+        ]
+
+        first = self.client.get(self.url, {"page_size": 10})
+        self.assertEqual(
+            [review["id"] for review in first.data["results"]],
+            [review.id for review in reversed(reviews)][:10],
+        )
+        second = self.client.get(first.data["next"])
+        self.assertEqual(len(second.data["results"]), 5)
+        self.assertIsNone(second.data["next"])
+        self.assertEqual(second.data["total_reviews"], 15)
+
+        by_rating = self.client.get(self.url, {"ordering": "-rating"})
+        self.assertEqual(by_rating.data["results"][0]["rating"], 5)
+
+    def test_unknown_product(self):
+        response = self.client.get("/shop/products/999999/reviews")
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductLikesTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.first, self.second = [
+            create_product(self.collection, index) for index in range(2)
+        ]
+
+    def toggle(self, product):
+        return self.client.post(
+            "/shop/products/favorite/mark", {"product_id": product.id}
+        )
+
+    def test_toggle_updates_stored_count(self):
+        self.client.force_authenticate(self.user)
+
+        response = self.toggle(self.first)
+        self.assertEqual(
+            response.data["results"],
+            {"product_id": self.first.id, "is_liked": True, "likes_count": 1},
+        )
+        self.first.refresh_from_db()
+        self.assertGreater(self.first.popularity, 0)
+
+        response = self.toggle(self.first)
+        self.assertEqual(
+            response.data["results"],
+            {"product_id": self.first.id, "is_liked": False, "likes_count": 0},
+        )
+        self.first.refresh_from_db()
+        self.assertAlmostEqual(self.first.popularity, 0)
+        self.assertFalse(Like.objects.exists())
+
+    def test_toggle_queries(self):
+        product_type = ContentType.objects.get_for_model(Product)
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                liked, _ = Like.objects.toggle(self.user, Product, self.first.id)
+        self.assertTrue(liked)
+        # DELETE ... RETURNING then INSERT, in a transaction
+        self.assertEqual(
+            len([query for query in queries if "likes_like" in query["sql"]]), 2
+        )
+        like = Like.objects.get()
+        self.assertEqual(
+            (like.user_id, like.content_type_id, like.object_id),
+            (self.user.id, product_type.id, self.first.id),
+        )
+
+        liked, created_at = Like.objects.toggle(self.user, Product, self.first.id)
+        self.assertFalse(liked)
+        self.assertEqual(created_at, like.created_at)
+
+    def test_toggle_without_returning_or_on_conflict(self):
+        features = connection.features
+        with mock.patch.object(
+            features, "supports_update_conflicts_with_target", False
+        ), CaptureQueriesContext(connection) as queries:
+            liked, created_at = Like.objects.toggle(self.user, Product, self.first.id)
+            self.assertTrue(liked)
+            self.assertEqual(Like.objects.get().created_at, created_at)
+
+            liked, deleted_at = Like.objects.toggle(self.user, Product, self.first.id)
+            self.assertFalse(liked)
+            self.assertEqual(deleted_at, created_at)
+            self.assertFalse(Like.objects.exists())
+
+            with self.assertRaises(Product.DoesNotExist):
+                Like.objects.toggle(self.user, Product, 999999)
+        self.assertFalse(
+            any("ON CONFLICT" in query["sql"] for query in queries.captured_queries)
+        )
+
+    def test_like_missing_product(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            "/shop/products/favorite/mark", {"product_id": 999999}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Like.objects.exists())
+
+    def test_likes_are_unique(self):
+        product_type = ContentType.objects.get_for_model(Product)
+        Like.objects.create(
+            user=self.user, content_type=product_type, object_id=self.first.id
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Like.objects.create(
+                user=self.user, content_type=product_type, object_id=self.first.id
+            )
+
+    def test_is_liked_is_set_per_user_after_cache(self):
+        self.client.force_authenticate(self.user)
+        self.toggle(self.second)
+
+        self.client.get("/shop/products")
+        # Cached page, only one query for the likes of the whole page
+        with self.assertNumQueries(1):
+            response = self.client.get("/shop/products")
+        self.assertEqual(response["X-Cache"], "HIT")
+        liked = {item["id"]: item["is_liked"] for item in response.data["results"]}
+        self.assertEqual(liked, {self.first.id: False, self.second.id: True})
+
+        self.client.force_authenticate(None)
+        response = self.client.get("/shop/products")
+        self.assertFalse(any(item["is_liked"] for item in response.data["results"]))
+
+    def test_is_liked_without_id(self):
+        self.client.force_authenticate(self.user)
+        self.toggle(self.second)
+        params = {"fields": "title,is_liked"}
+
+        for _ in range(2):
+            response = self.client.get("/shop/products", params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response.data["results"],
+                [
+                    {"title": self.first.title, "is_liked": False},
+                    {"title": self.second.title, "is_liked": True},
+                ],
+            )
+
+        response = self.client.get(f"/shop/products/{self.second.id}", params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"title": self.second.title, "is_liked": True})
+
+        response = self.client.get(
+            "/shop/products/bulk", {"ids": str(self.second.id), "fields": "title"}
+        )
+        self.assertEqual(response.data["results"], [{"title": self.second.title}])
+
+
+class CartPricingTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.first, self.second = [
+            create_product(self.collection, index) for index in range(2)
+        ]
+        SizeInventory.objects.create(
+            product=self.first, size=self.size, quantity=2, extra_price="1.50"
+        )
+        ColorInventory.objects.create(
+            product=self.first, color=self.red, quantity=3, extra_price="0.25"
+        )
+        ColorInventory.objects.create(product=self.second, color=self.red, quantity=1)
+
+        CartItem.objects.create(
+            cart=self.cart, product=self.first, quantity=2, size="XL", color="Red"
+        )
+        CartItem.objects.create(
+            cart=self.cart, product=self.second, quantity=3, color="Red"
+        )
+
+    def test_prices_every_line_with_one_query(self):
+        items = list(self.cart.items.select_related("product").order_by("id"))
+        with self.assertNumQueries(1):
+            pricing = CartPricing.for_items(items)
+
+        self.assertEqual(
+            [pricing.item_total(item) for item in items],
+            [Decimal("23.50"), Decimal("30.00")],
+        )
+        self.assertEqual(pricing.total(items), Decimal("53.50"))
+
+    def test_cart_payload(self):
+        response = self.client.get(f"/shop/carts/{self.cart.id}/items")
+        self.assertEqual(
+            [item["total_price"] for item in response.data],
+            [Decimal("23.50"), Decimal("30.00")],
+        )
+
+        data = CartSerializer(
+            Cart.objects.prefetch_related("items__product").get(),
+            context={"request": APIRequestFactory().get("/")},
+        ).data
+        self.assertEqual(data["cart_total_price"], Decimal("53.50"))
+        self.assertEqual(
+            [item["total_price"] for item in data["items"]],
+            [Decimal("23.50"), Decimal("30.00")],
+        )
+
+
+class ReferenceDataTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_product(self.collection, 1)
+        ColorInventory.objects.create(product=self.product, color=self.red, quantity=3)
+        SizeInventory.objects.create(product=self.product, size=self.size, quantity=3)
+        CartItem.objects.create(
+            cart=self.cart, product=self.product, quantity=1, color="Red"
+        )
+
+    def reference_queries(self, queries):
+        return [
+            query["sql"]
+            for query in queries
+            if 'FROM "shop_color"' in query["sql"] or 'FROM "shop_size"' in query["sql"]
+        ]
+
+    def test_cart_endpoints_skip_reference_queries(self):
+        reference_data.colors.get("Red")
+        reference_data.sizes.get("XL")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/shop/carts/{self.cart.id}")
+            self.client.get(f"/shop/carts/{self.cart.id}/items")
+            self.client.post(
+                f"/shop/carts/{self.cart.id}/items",
+                {"product_id": self.product.id, "quantity": 1, "size": "XL"},
+            )
+        self.assertEqual(response.data["items"][0]["hex_code"], "#ff0000")
+        self.assertEqual(self.reference_queries(queries), [])
+
+    def test_writes_invalidate(self):
+        self.assertEqual(reference_data.colors.get("Red").hex_code, "#ff0000")
+        self.red.hex_code = "#ee0000"
+        self.red.save()
+        self.assertEqual(reference_data.colors.get("Red").hex_code, "#ee0000")
+
+        version = cache.get(reference_data.colors.version_key)
+        Color.objects.create(name="Green", hex_code="#00ff00")
+        self.assertNotEqual(cache.get(reference_data.colors.version_key), version)
+        self.assertIsNotNone(reference_data.colors.get("Green"))
+
+        self.size.delete()
+        self.assertIsNone(reference_data.sizes.get("XL"))
+
+
+class AddCartItemValidationTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_product(self.collection, 1)
+        ColorInventory.objects.create(product=self.product, color=self.red, quantity=0)
+        SizeInventory.objects.create(product=self.product, size=self.size, quantity=3)
+        self.url = f"/shop/carts/{self.cart.id}/items"
+
+    def test_validates_in_one_query(self):
+        items = [
+            {"product_id": self.product.id, "size": "XL", "color": "Red"},
+            {"product_id": self.product.id, "size": "XS", "color": "Blue"},
+            {"product_id": 999999, "size": "XL"},
+        ]
+        reference_data.colors.get("Red")
+        reference_data.sizes.get("XL")
+
+        with self.assertNumQueries(1):
+            errors = validate_items(items)
+        self.assertEqual(
+            errors,
+            [
+                {"color": "This color for this product is no longer in stock!"},
+                {
+                    "size": "Invalid size object",
+                    "color": "We don't have that color for this specific product!",
+                },
+                {"product_id": "No product with the given ID was found."},
+            ],
+        )
+
+    def test_reports_every_error(self):
+        response = self.client.post(
+            self.url,
+            {"product_id": self.product.id, "quantity": 1, "size": "S", "color": "Red"},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data["errors"]), {"size", "color"})
+        self.assertFalse(CartItem.objects.exists())
+
+        response = self.client.post(
+            self.url, {"product_id": self.product.id, "quantity": 1, "size": "XL"}
+        )
+        self.assertEqual(response.status_code, 201)
+
+
+class CartItemUpsertTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_product(self.collection, 1)
+        SizeInventory.objects.create(product=self.product, size=self.size, quantity=3)
+
+    def test_adding_twice_increments(self):
+        url = f"/shop/carts/{self.cart.id}/items"
+        for quantity in [1, 2]:
+            response = self.client.post(
+                url, {"product_id": self.product.id, "quantity": quantity}
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["quantity"], 3)
+        self.client.post(
+            url, {"product_id": self.product.id, "quantity": 1, "size": "XL"}
+        )
+
+        self.assertEqual(
+            sorted(self.cart.items.values_list("size", "quantity"), key=str),
+            [("XL", 1), (None, 3)],
+        )
+
+    def test_single_statement(self):
+        Cart.objects.filter(pk=self.cart.pk).update(
+            last_update=timezone.now() - timedelta(days=1)
+        )
+        add_item(self.cart.id, self.product.id, 2, size="XL")
+
+        with CaptureQueriesContext(connection) as queries:
+            item = add_item(self.cart.id, self.product.id, 3, size="XL")
+        self.assertEqual(item.quantity, 5)
+        self.assertEqual(
+            len([query for query in queries if "shop_cartitem" in query["sql"]]), 1
+        )
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+
+        self.cart.refresh_from_db()
+        self.assertGreater(self.cart.last_update, timezone.now() - timedelta(hours=1))
+
+
+class CartItemBatchTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.first, self.second = [
+            create_product(self.collection, index) for index in range(2)
+        ]
+        SizeInventory.objects.create(
+            product=self.first, size=self.size, quantity=3, extra_price="1.00"
+        )
+        self.kept = CartItem.objects.create(
+            cart=self.cart, product=self.first, quantity=1
+        )
+        self.removed = CartItem.objects.create(
+            cart=self.cart, product=self.second, quantity=1
+        )
+        self.url = f"/shop/carts/{self.cart.id}/items/batch"
+
+    def test_applies_every_change(self):
+        response = self.client.post(
+            self.url,
+            {
+                "add": [
+                    {"product_id": self.first.id, "quantity": 1, "size": "XL"},
+                    {"product_id": self.first.id, "quantity": 2, "size": "XL"},
+                    {"product_id": self.first.id, "quantity": 1},
+                ],
+                "update": [{"id": self.kept.id, "quantity": 4}],
+                "remove": [self.removed.id],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(
+                (item["size"] or "", item["quantity"], item["total_price"])
+                for item in response.data["items"]
+            ),
+            [("", 5, Decimal("50.00")), ("XL", 3, Decimal("33.00"))],
+        )
+        self.assertEqual(response.data["cart_total_price"], Decimal("83.00"))
+        self.assertFalse(CartItem.objects.filter(pk=self.removed.pk).exists())
+
+    def test_all_or_nothing(self):
+        other = CartItem.objects.create(
+            cart=Cart.objects.create(), product=self.first, quantity=1
+        )
+        response = self.client.post(
+            self.url,
+            {
+                "add": [
+                    {"product_id": self.first.id, "quantity": 1, "size": "XL"},
+                    {"product_id": self.second.id, "quantity": 1, "size": "XL"},
+                ],
+                "update": [{"id": other.id, "quantity": 2}],
+                "remove": [self.removed.id],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data["errors"]), {"add", "update"})
+        self.assertEqual(list(response.data["errors"]["add"]), [1])
+        self.assertEqual(self.cart.items.count(), 2)
+        other.refresh_from_db()
+        self.assertEqual(other.quantity, 1)
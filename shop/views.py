@@ -1,10 +1,14 @@
 from datetime import datetime
 
-from django.db.models.aggregates import Count
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import status
+from django_filters.utils import translate_validation
+from rest_framework import generics, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.generics import GenericAPIView
 from rest_framework.mixins import (
@@ -13,62 +17,121 @@ from rest_framework.mixins import (
     ListModelMixin,
     RetrieveModelMixin,
 )
-from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
 from likes.models import Like
 from likes.views import LikeView
-from shop.pagination import DefaultPagination
+from shop import cache as catalog_cache
+from shop import conditional, export, fast_serializers, popularity
+from shop.autocomplete import title_index
+from shop.facets import FACETS
+from shop.pagination import DefaultPagination, KeysetPaginationMixin
 from shop.permissions import IsAdminOrReadOnly
+from shop.search import SearchResults
 
 from . import serializers as shop_serializer
 from .filters import ProductFilter
 from .models import (
+    RATINGS,
     BillingAddress,
     Cart,
     CartItem,
     Collection,
+    ColorInventory,
     Notification,
     Order,
     Product,
     ProductImage,
     Review,
+    SizeInventory,
     TrackOrder,
 )
 
 
-class Notifications(GenericAPIView):
+class Notifications(KeysetPaginationMixin, GenericAPIView):
     """
     Feed, Offers, Activity Notification
     """
 
     permission_classes = (IsAuthenticated,)
+    keyset_orderings = {"-created_at": ("-created_at", "-id")}
 
     def get(self, request):
         user = request.user
         notifications = Notification.objects.filter(users__in=[user]).values(
             "type", "title", "desc", "created_at"
         )
+        if self.paginator is None:
+            return Response(
+                {"message": "Notified", "data": notifications, "status": True},
+                status=200,
+            )
+
+        page = self.paginate_queryset(Notification.objects.filter(users__in=[user]))
+        data = [
+            {
+                "type": notification.type,
+                "title": notification.title,
+                "desc": notification.desc,
+                "created_at": notification.created_at,
+            }
+            for notification in page
+        ]
         return Response(
-            {"message": "Notified", "data": notifications, "status": True}, status=200
+            {
+                "message": "Notified",
+                "data": data,
+                "status": True,
+                **self.paginator.get_page_info(),
+            },
+            status=200,
         )
 
 
 class CollectionViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
     permission_classes = [IsAdminOrReadOnly]
     serializer_class = shop_serializer.CollectionSerializer
-    queryset = Collection.objects.annotate(products_count=Count("products")).all()
+    queryset = Collection.objects.all()
 
-
-class ProductViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
-    queryset = (
-        Product.objects.prefetch_related(
-            "images", "reviews", "size_inventory__size", "color_inventory__color",
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = conditional.collection_list_validators(request)
+        return conditional.conditional_response(
+            request,
+            etag,
+            last_modified,
+            lambda: super(CollectionViewSet, self).list(request, *args, **kwargs),
         )
-        .select_related("collection")
-        .all()
+
+
+def product_listing_queryset(fields=None):
+    """
+    Products with the prefetched relations ProductSerializer needs to render
+    `fields`, all of its fields by default.
+    """
+    if fields is None:
+        fields = shop_serializer.ProductSerializer.Meta.fields
+
+    products = Product.objects.all()
+    prefetches = {
+        "images": lambda: "images",
+        "sizes": lambda: Prefetch(
+            "size_inventory", SizeInventory.objects.select_related("size")
+        ),
+        "colors": lambda: Prefetch(
+            "color_inventory", ColorInventory.objects.select_related("color")
+        ),
+    }
+    return products.prefetch_related(
+        *[prefetch() for name, prefetch in prefetches.items() if name in fields]
     )
+
+
+class ProductViewSet(
+    KeysetPaginationMixin, ListModelMixin, RetrieveModelMixin, GenericViewSet
+):
+    queryset = product_listing_queryset()
     serializer_class = shop_serializer.ProductSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_class = ProductFilter
@@ -77,27 +140,394 @@ class ProductViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
     search_fields = [
         "title",
         "description",
-        "collection__name",
+        "collection__title",
         # "colors__name",
         # "sizes__size",
     ]
-    ordering_fields = ["unit_price", "last_update", "category"]
+    ordering_fields = ["unit_price", "last_update", "category", "popularity"]
+    keyset_orderings = {
+        "title": ("title", "id"),
+        "-last_update": ("-last_update", "-id"),
+        "last_update": ("last_update", "id"),
+        "unit_price": ("unit_price", "id"),
+        "-unit_price": ("-unit_price", "-id"),
+        "-popularity": ("-popularity", "-id"),
+    }
+
+    # Most products `bulk` returns in one response
+    max_bulk_ids = 50
+    # Largest id the 64-bit primary key column can hold
+    max_product_id = 2**63 - 1
+    # Products `trending` returns by default and at most
+    trending_limit = 20
+    max_trending_limit = 100
+    # Suggestions `autocomplete` returns per kind by default and at most
+    autocomplete_limit = 8
+    max_autocomplete_limit = 20
+
+    # Nested relations, left out of sparse fieldsets unless expanded
+    expandable_fields = ["images", "colors", "sizes"]
+
+    def get_requested_fields(self):
+        """
+        The fields asked for with `?fields=` and `?expand=`, or None for the
+        full payload. `expand` alone keeps every plain field and adds the
+        listed relations.
+        """
+        if hasattr(self, "_requested_fields"):
+            return self._requested_fields
+
+        def split(param):
+            value = self.request.query_params.get(param)
+            if value is None:
+                return None
+            return {name.strip() for name in value.split(",") if name.strip()}
+
+        fields, expand = split("fields"), split("expand")
+        all_fields = self.serializer_class.Meta.fields
+
+        unknown = (fields or set()) - set(all_fields)
+        unknown |= (expand or set()) - set(self.expandable_fields)
+        if unknown:
+            raise ValidationError(
+                {
+                    "message": f"Unknown fields: {', '.join(sorted(unknown))}",
+                    "status": False,
+                }
+            )
+
+        requested = None
+        if fields is not None or expand is not None:
+            if fields is None:
+                fields = set(all_fields) - set(self.expandable_fields)
+            requested = [
+                name for name in all_fields if name in fields | (expand or set())
+            ]
+
+        self._requested_fields = requested
+        return requested
+
+    def get_rendered_fields(self):
+        """
+        The requested fields plus `id`, which `mark_liked` and the actions
+        keyed by product need, and which `mark_liked` strips when it wasn't
+        requested.
+        """
+        fields = self.get_requested_fields()
+        if fields is None or "id" in fields:
+            return fields
+        return ["id", *fields]
+
+    def get_queryset(self):
+        return product_listing_queryset(self.get_requested_fields())
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault("fields", self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
 
     def get_serializer_context(self):
         return {"request": self.request}
 
+    def get_rows(self, queryset):
+        """
+        `queryset` as rows for `fast_serializers.render_products()`, with the
+        columns of every keyset ordering so a cursor can be built from them.
+        """
+        columns = {
+            name.lstrip("-")
+            for ordering in self.keyset_orderings.values()
+            for name in ordering
+        }
+        return fast_serializers.product_rows(
+            queryset, self.get_rendered_fields(), extra_columns=columns
+        )
+
+    def render(self, rows):
+        return fast_serializers.render_products(
+            rows, self.request, self.get_rendered_fields()
+        )
+
+    def mark_liked(self, response):
+        """
+        Set the `is_liked` flags of the products of a, possibly cached,
+        response for the current user, with one query for the whole page,
+        then drop the `id` rendered for it if it wasn't requested.
+        """
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        data = response.data
+        products = data["results"] if "results" in data else [data]
+        liked = [product for product in products if "is_liked" in product]
+        liked_ids = Like.objects.liked_ids(
+            self.request.user, Product, [product["id"] for product in liked]
+        )
+        for product in liked:
+            product["is_liked"] = product["id"] in liked_ids
+        if self.get_rendered_fields() != self.get_requested_fields():
+            for product in products:
+                product.pop("id", None)
+        return response
+
+    def list_products(self, request, *args, **kwargs):
+        # Same payload as ListModelMixin.list, built without serializer objects
+        rows = self.get_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.render(page))
+        return Response(self.render(rows))
+
+    def retrieve_product(self, request, *args, **kwargs):
+        rows = self.get_rows(self.get_queryset())
+        row = generics.get_object_or_404(rows, pk=kwargs["pk"])
+        return Response(self.render([row])[0])
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = conditional.product_list_validators(request)
+        return conditional.conditional_response(
+            request,
+            etag,
+            last_modified,
+            lambda: self.mark_liked(
+                catalog_cache.cached_response(
+                    request, self.list_products, *args, **kwargs
+                )
+            ),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        etag, last_modified = conditional.product_validators(request, kwargs["pk"])
+        return conditional.conditional_response(
+            request,
+            etag,
+            last_modified,
+            lambda: self.mark_liked(
+                catalog_cache.cached_response(
+                    request,
+                    self.retrieve_product,
+                    *args,
+                    product_id=kwargs["pk"],
+                    **kwargs,
+                )
+            ),
+        )
+
+    @action(detail=False, methods=["GET"], permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        return Response(
+            {"data": catalog_cache.cache_stats(), "status": True},
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=False, methods=["GET"], permission_classes=[IsAdminUser])
+    def export(self, request):
+        """
+        Stream the whole catalog as NDJSON, optionally only the products
+        updated since `?updated_since=` (an ISO 8601 date or datetime).
+        """
+        updated_since = request.query_params.get("updated_since")
+        if updated_since is not None:
+            try:
+                updated_since = export.parse_updated_since(updated_since)
+            except ValueError:
+                return Response(
+                    {"message": "Invalid updated_since date", "status": False},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+        response = StreamingHttpResponse(
+            export.export_products(updated_since, request=request),
+            content_type="application/x-ndjson",
+        )
+        response["Content-Disposition"] = 'attachment; filename="catalog.ndjson"'
+        return response
+
+    def facet_queryset(self, excluded_params):
+        """The products matching the current filters except `excluded_params`."""
+        params = self.request.query_params.copy()
+        for param in excluded_params:
+            params.pop(param, None)
+
+        filterset = self.filterset_class(
+            params, queryset=Product.objects.all(), request=self.request
+        )
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+        return SearchFilter().filter_queryset(self.request, filterset.qs, self)
+
+    @action(detail=False, methods=["GET"])
+    def facets(self, request):
+        """
+        Per collection, color, size and price range product counts for the
+        current filters, one grouped query per facet.
+        """
+        data = {
+            name: count(self.facet_queryset(params))
+            for name, (count, params) in FACETS.items()
+        }
+        return Response({"data": data, "status": True}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["GET"])
+    def bulk(self, request):
+        """
+        The products listed in `?ids=`, in the requested order, with the ids
+        that don't exist reported in `missing`.
+        """
+        try:
+            ids = [
+                int(value)
+                for value in request.query_params.get("ids", "").split(",")
+                if value.strip()
+            ]
+        except ValueError:
+            ids = None
+        # Out of range ids overflow the database integers
+        if not ids or not all(0 < pk <= self.max_product_id for pk in ids):
+            return Response(
+                {
+                    "message": "A comma separated list of product ids is required",
+                    "status": False,
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > self.max_bulk_ids:
+            return Response(
+                {
+                    "message": f"At most {self.max_bulk_ids} products can be "
+                    "fetched at once",
+                    "status": False,
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        rows = self.get_rows(self.get_queryset().filter(pk__in=ids))
+        products = {product["id"]: product for product in self.render(rows)}
+        return self.mark_liked(
+            Response(
+                {
+                    "results": [products[pk] for pk in ids if pk in products],
+                    "missing": [pk for pk in ids if pk not in products],
+                    "status": True,
+                },
+                status=status.HTTP_200_OK,
+            )
+        )
+
+    @action(detail=False, methods=["GET"])
+    def trending(self, request):
+        """
+        The most popular products right now (`?limit=` of them) with their
+        decayed popularity score, filters apply as on the list.
+        """
+        return self.mark_liked(
+            catalog_cache.cached_response(request, self.trending_products)
+        )
+
+    def trending_products(self, request):
+        try:
+            limit = int(request.query_params.get("limit", self.trending_limit))
+        except ValueError:
+            limit = self.trending_limit
+        limit = min(max(limit, 1), self.max_trending_limit)
+
+        products = self.filter_queryset(self.get_queryset())
+        rows = list(self.get_rows(products.order_by("-popularity", "-id"))[:limit])
+        results = self.render(rows)
+
+        now = timezone.now()
+        for row, data in zip(rows, results):
+            data["popularity"] = round(
+                popularity.current_score(row["popularity"], now), 4
+            )
+        return Response({"results": results, "status": True}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["GET"])
+    def related(self, request, pk=None):
+        """
+        The products most often bought with this one, as stored by the
+        `build_related_products` command.
+        """
+        product = generics.get_object_or_404(Product.objects.only("pk"), pk=pk)
+        rows = self.get_rows(
+            self.get_queryset()
+            .filter(related_to__product=product)
+            .order_by("related_to__rank")
+        )
+        return self.mark_liked(
+            Response(
+                {"results": self.render(rows), "status": True},
+                status=status.HTTP_200_OK,
+            )
+        )
+
+    @action(detail=False, methods=["GET"])
+    def autocomplete(self, request):
+        """
+        Product and collection titles with a word starting with every word of
+        `?q=`, served from the in-memory prefix index.
+        """
+        try:
+            limit = int(request.query_params.get("limit", self.autocomplete_limit))
+        except ValueError:
+            limit = self.autocomplete_limit
+        limit = min(max(limit, 1), self.max_autocomplete_limit)
+
+        suggestions = title_index.suggest(request.query_params.get("q", ""), limit)
+        return Response(
+            {"results": suggestions, "status": True}, status=status.HTTP_200_OK
+        )
+
+    @action(detail=False, methods=["GET"])
+    def search(self, request):
+        """
+        Full-text search over product titles, descriptions and collection
+        titles, ranked by relevance with the matches highlighted.
+        """
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response(
+                {"message": "A search query is required", "status": False},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Keyset pagination needs a QuerySet, SearchResults always pages by number
+        paginator = self.pagination_class()
+        hits = paginator.paginate_queryset(SearchResults(query), request, view=self)
+        rows = self.get_rows(
+            self.get_queryset().filter(pk__in=[hit.product_id for hit in hits])
+        )
+        products = {product["id"]: product for product in self.render(rows)}
+
+        results = []
+        for hit in hits:
+            data = products.get(hit.product_id)
+            if data is None:
+                continue
+            data["search"] = {
+                "rank": hit.rank,
+                "title": hit.title,
+                "snippet": hit.snippet,
+            }
+            results.append(data)
+
+        return self.mark_liked(paginator.get_paginated_response(results))
+
     @action(
         detail=False,
         methods=["GET"],
         permission_classes=[IsAuthenticated],
     )
     def my_favorites(self, request):
-        products = Like.objects.objects_liked_by_user(request.user, Product)
-        serializer = self.serializer_class(products, many=True)
+        products = Like.objects.objects_liked_by_user(
+            request.user, Product, queryset=self.get_queryset()
+        )
 
-        return Response(
-            data={"results": serializer.data, "status": True},
-            status=status.HTTP_200_OK,
+        return self.mark_liked(
+            Response(
+                data={"results": self.render(self.get_rows(products)), "status": True},
+                status=status.HTTP_200_OK,
+            )
         )
 
 
@@ -120,16 +550,38 @@ class LikeProductView(LikeView):
         message = "Product marked as favorite"
         if self.unlike:
             message = "Product removed from favorite"
+        product_id = int(request.data["product_id"])
+        catalog_cache.invalidate_products([product_id])
 
-        product_instance = Product.objects.get(id=request.data["product_id"])
-        data = shop_serializer.ProductSerializer(product_instance).data
+        likes_count = (
+            Product.objects.filter(pk=product_id)
+            .values_list("likes_count", flat=True)
+            .first()
+        )
         return Response(
-            {"status": True, "message": message, "results": data},
+            {
+                "status": True,
+                "message": message,
+                "results": {
+                    "product_id": product_id,
+                    "is_liked": not self.unlike,
+                    "likes_count": likes_count,
+                },
+            },
             status=status.HTTP_200_OK,
         )
 
 
-class ReviewViewSet(GenericViewSet):
+class ReviewViewSet(KeysetPaginationMixin, GenericViewSet):
+    # Every page is read from an index, the totals come from the product row
+    keyset_orderings = {
+        "-date": ("-date", "-id"),
+        "-rating": ("-rating", "-id"),
+        "rating": ("rating", "id"),
+    }
+    keyset_only = True
+    keyset_count = False
+
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs["product_pk"])
 
@@ -142,7 +594,7 @@ class ReviewViewSet(GenericViewSet):
         return shop_serializer.ReviewSerializer
 
     def create(self, request, **kwargs):
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
         data = serializer.data
@@ -150,18 +602,29 @@ class ReviewViewSet(GenericViewSet):
         return Response(data, status=status.HTTP_201_CREATED)
 
     def list(self, request, **kwargs):
-        product_reviews = self.get_queryset()
-        total_reviews = product_reviews.count()
-        sum_of_ratings = sum([item.ratings for item in product_reviews])
-
-        try:
-            rating = float(sum_of_ratings / total_reviews)
-        except ZeroDivisionError:
-            rating = 1.0
-            total_reviews = 1
+        product = generics.get_object_or_404(
+            Product.objects.only(
+                "review_count",
+                "average_rating",
+                *(f"stars_{rating}" for rating in RATINGS),
+            ),
+            pk=kwargs["product_pk"],
+        )
+        reviews = self.paginate_queryset(
+            self.get_queryset().only("id", "rating", "description", "date")
+        )
 
         return Response(
-            {"total_reviews": total_reviews, "rating": rating, "status": True},
+            {
+                "total_reviews": product.total_review,
+                "rating": product.rating,
+                "histogram": product.rating_histogram,
+                **self.paginator.get_page_info(),
+                "results": shop_serializer.ProductReviewSerializer(
+                    reviews, many=True
+                ).data,
+                "status": True,
+            },
             status=status.HTTP_200_OK,
         )
 
@@ -172,11 +635,27 @@ class CartViewSet(
     queryset = Cart.objects.prefetch_related("items__product").all()
     serializer_class = shop_serializer.CartSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        etag, last_modified = conditional.cart_validators(request, kwargs["pk"])
+        return conditional.conditional_response(
+            request,
+            etag,
+            last_modified,
+            lambda: self.retrieve_cart(request, *args, **kwargs),
+        )
+
+    def retrieve_cart(self, request, *args, **kwargs):
+        # Same payload as CartSerializer, built without serializer objects
+        cart = generics.get_object_or_404(Cart.objects.only("id"), pk=kwargs["pk"])
+        return Response(fast_serializers.render_cart(cart.id, request))
+
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ["get", "post", "patch", "delete"]
 
     def get_serializer_class(self):
+        if self.action == "batch":
+            return shop_serializer.CartItemBatchSerializer
         if self.request.method == "POST":
             return shop_serializer.AddCartItemSerializer
         elif self.request.method == "PATCH":
@@ -191,10 +670,30 @@ class CartItemViewSet(ModelViewSet):
             "product"
         )
 
+    @action(detail=False, methods=["POST"])
+    def batch(self, request, cart_pk=None):
+        """
+        Apply `add`, `update` and `remove` lists of items in one transaction,
+        all or nothing, and return the repriced cart.
+        """
+        cart = generics.get_object_or_404(Cart.objects.only("id"), pk=cart_pk)
+        serializer = shop_serializer.CartItemBatchSerializer(
+            data=request.data, context={"cart_id": cart.id}
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(
+            fast_serializers.render_cart(cart.id, request), status=status.HTTP_200_OK
+        )
+
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(KeysetPaginationMixin, ModelViewSet):
     http_method_names = ["get", "post", "head", "options"]
     permission_classes = [IsAuthenticated]
+    keyset_orderings = {
+        "-placed_at": ("-placed_at", "-id"),
+        "placed_at": ("placed_at", "id"),
+    }
 
     def create(self, request, *args, **kwargs):
         serializer = shop_serializer.CreateOrderSerializer(